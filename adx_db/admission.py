@@ -0,0 +1,171 @@
+import heapq
+import itertools
+import time
+from threading import Event, Lock
+
+from adx_db.exceptions import OperationalError, ProgrammingError
+from adx_db.instrumentation import metrics
+
+INTERACTIVE = 'interactive'
+SCHEDULED = 'scheduled'
+
+# queries of a lower rank are admitted first, e.g. charts before scheduled reports
+PRIORITIES = {INTERACTIVE: 0, SCHEDULED: 1}
+
+
+def priority_rank(priority: str):
+    try:
+        return PRIORITIES[priority]
+    except KeyError:
+        raise ProgrammingError('Unknown priority `{0}`, expected one of: {1}'.format(
+            priority, ', '.join(sorted(PRIORITIES))))
+
+
+class _Waiter(object):
+
+    def __init__(self):
+        self.event = Event()
+        self.admitted = False
+        self.abandoned = False
+
+
+class Limiter(object):
+    """
+    At most `limit` queries running at the same time, the others wait in a
+    queue of at most `max_queue` queries, in the order of their priority and
+    then of their arrival.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int = 100):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiting = 0
+        self._queue = []  # heap of (rank, arrival, waiter)
+        self._arrivals = itertools.count()
+        self._lock = Lock()
+
+    def acquire(self, priority: str = INTERACTIVE, timeout: float = None, cancellation=None):
+        """
+        Wait for a slot at most `timeout` seconds, raise OperationalError when
+        the queue is full, on timeout or when the query is cancelled.
+        """
+        with self._lock:
+            if self.running < self.limit and not self.waiting:
+                self.running += 1
+                return
+            if self.waiting >= self.max_queue:
+                metrics.increment('admission_rejections')
+                raise OperationalError('Too many queries waiting for {0}'.format(self.name))
+
+            waiter = _Waiter()
+            heapq.heappush(self._queue, (priority_rank(priority), next(self._arrivals), waiter))
+            self.waiting += 1
+            metrics.observe('admission_queue_depth', self.waiting)
+
+        if cancellation is not None:
+            cancellation.on_cancel(waiter.event.set)
+        waiter.event.wait(timeout)
+
+        with self._lock:
+            if waiter.admitted:
+                return
+            waiter.abandoned = True
+            self.waiting -= 1
+
+        if cancellation is not None and cancellation.cancelled:
+            raise OperationalError('Query cancelled')
+        metrics.increment('admission_timeouts')
+        raise OperationalError('Query waited more than {0}s for {1}'.format(timeout, self.name))
+
+    def release(self):
+        with self._lock:
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.abandoned:
+                    continue
+                # the slot goes to the next query
+                waiter.admitted = True
+                self.waiting -= 1
+                waiter.event.set()
+                return
+            self.running -= 1
+
+
+class AdmissionControl(object):
+    """
+    Limits of the number of queries run at the same time by the process on a
+    cluster (`cluster_limit`) and on a database (`database_limit`), None for
+    no limit. A query waits for a slot at most `queue_timeout` seconds.
+    """
+
+    def __init__(self,
+                 cluster_limit: int = None,
+                 database_limit: int = None,
+                 max_queue: int = 100,
+                 queue_timeout: float = None):
+        self.configure(cluster_limit, database_limit, max_queue, queue_timeout)
+
+    def configure(self,
+                  cluster_limit: int = None,
+                  database_limit: int = None,
+                  max_queue: int = 100,
+                  queue_timeout: float = None):
+        """Set the limits, the queries already waiting keep the previous ones."""
+        self.cluster_limit = cluster_limit
+        self.database_limit = database_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._limiters = {}
+        self._lock = Lock()
+
+    def _limiter(self, key, limit):
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(key)
+                if limiter is None:
+                    limiter = self._limiters[key] = Limiter('/'.join(key), limit, self.max_queue)
+        return limiter
+
+    def limiters(self, cluster: str, database: str):
+        """Return the limiters of a query, in the order they are acquired."""
+        limiters = []
+        # the database slot first, a query waiting for its database does not hold a cluster slot
+        if self.database_limit:
+            limiters.append(self._limiter((cluster, database), self.database_limit))
+        if self.cluster_limit:
+            limiters.append(self._limiter((cluster,), self.cluster_limit))
+        return limiters
+
+    def admit(self, cluster: str, database: str, priority: str = INTERACTIVE, timeout: float = None,
+              cancellation=None):
+        """
+        Wait for the slots of a query, at most `timeout` or `queue_timeout`
+        seconds, and return the limiters to release once it is done.
+        """
+        priority_rank(priority)
+        limiters = self.limiters(cluster, database)
+        if not limiters:
+            return limiters
+
+        if self.queue_timeout is not None:
+            timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        start = time.monotonic()
+        acquired = []
+        try:
+            for limiter in limiters:
+                remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - start))
+                limiter.acquire(priority, remaining, cancellation)
+                acquired.append(limiter)
+        except OperationalError:
+            self.release(acquired)
+            raise
+        finally:
+            metrics.observe('admission_wait_time', time.monotonic() - start)
+        return acquired
+
+    def release(self, limiters):
+        for limiter in reversed(limiters):
+            limiter.release()
@@ -0,0 +1,82 @@
+import logging
+
+from adx_db.exceptions import OperationalError, ProgrammingError
+from adx_db.instrumentation import metrics
+from adx_db.result_cache import estimate_rows_size
+
+logger = logging.getLogger(__name__)
+
+# what is done with a result beyond its budget
+WARN = 'warn'
+RAISE = 'raise'
+
+
+class ResultBudget(object):
+    """
+    At most `max_rows` rows and `max_bytes` bytes (the size of their json
+    payload) read for a query, None for no limit. Select statements without
+    a LIMIT are limited to `max_rows` by the translator, the cluster
+    truncates the results of all the queries (see `request_options`), and
+    the rows beyond the budget are dropped with a warning
+    (`on_exceeded='warn'`), or the query fails with OperationalError
+    (`on_exceeded='raise'`).
+    """
+
+    def __init__(self, max_rows: int = None, max_bytes: int = None, on_exceeded: str = WARN):
+        if on_exceeded not in (WARN, RAISE):
+            raise ProgrammingError('Unknown on_exceeded `{0}`, expected {1} or {2}'.format(on_exceeded, WARN, RAISE))
+        self.max_rows = int(max_rows) if max_rows is not None else None
+        self.max_bytes = int(max_bytes) if max_bytes is not None else None
+        self.on_exceeded = on_exceeded
+
+    def __repr__(self):
+        return 'ResultBudget(max_rows={0}, max_bytes={1}, on_exceeded={2})'.format(
+            self.max_rows, self.max_bytes, self.on_exceeded)
+
+    @property
+    def row_cap(self):
+        """Return the LIMIT added to the select statements without one, None for no limit."""
+        # one row more than the budget, so a result beyond it is noticed
+        return self.max_rows + 1 if self.max_rows is not None else None
+
+    def request_options(self):
+        """
+        Return the request properties truncating a result on the cluster,
+        named as in `adx_db.query.REQUEST_PROPERTIES`: to `row_cap` rows, so
+        a result beyond the budget is still noticed, and to `max_bytes`.
+        The truncation is then reported in the QueryCompletionInformation, an
+        error row in the result would fail the query in the kusto client.
+        """
+        options = {}
+        if self.max_rows is not None:
+            options['truncation_max_records'] = self.row_cap
+        if self.max_bytes is not None:
+            options['truncation_max_size'] = self.max_bytes
+        if options:
+            options['defer_partial_query_failures'] = True
+        return options
+
+    def apply(self, rows: list, truncated: bool = False, rows_read: int = 0, bytes_read: int = 0):
+        """
+        Return `(rows, truncated)`, the raw rows of a result within the
+        budget, `truncated` when the cluster already truncated them. Their
+        size is estimated from a sample of them, see `estimate_rows_size`.
+        For a result read page by page, `rows_read` and `bytes_read` are
+        what the previous pages used of the budget.
+        """
+        count = len(rows) if self.max_rows is None else max(min(len(rows), self.max_rows - rows_read), 0)
+        if self.max_bytes is not None and count:
+            size = estimate_rows_size(rows[:count])
+            if size > self.max_bytes - bytes_read:
+                count = count * max(self.max_bytes - bytes_read, 0) // size
+
+        if count == len(rows) and not truncated:
+            return rows, False
+
+        metrics.increment('results_truncated')
+        message = 'Query result exceeds the budget of {0} rows and {1} bytes, add a LIMIT to the query'.format(
+            self.max_rows, self.max_bytes)
+        if self.on_exceeded == RAISE:
+            raise OperationalError(message)
+        logger.warning('%s, only its first %s rows are returned', message, rows_read + count)
+        return rows[:count], True
@@ -0,0 +1,130 @@
+import logging
+import time
+from collections import deque
+from threading import Lock
+
+from adx_db.exceptions import OperationalError
+from adx_db.instrumentation import emit, metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker(object):
+    """
+    Health of a cluster. The breaker opens when at least `failure_rate` of
+    the last `window` requests (and at least `min_requests` of them) failed,
+    requests are then rejected at once for `reset_timeout` seconds. It then
+    half-opens: `probes` requests are let through, it closes when one of
+    them succeeds and opens again when one fails.
+    """
+
+    def __init__(self,
+                 name: str,
+                 failure_rate: float = 0.5,
+                 window: int = 20,
+                 min_requests: int = 10,
+                 reset_timeout: float = 30,
+                 probes: int = 1):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)  # True for the failed requests
+        self._opened_at = None
+        self._probing = 0
+        self._lock = Lock()
+
+    def _transition(self, state):
+        """Change the state, with the lock held, return the previous one."""
+        previous, self.state = self.state, state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            logger.warning('Circuit breaker of %s is open for %ss', self.name, self.reset_timeout)
+        if state != HALF_OPEN:
+            self._probing = 0
+        if state == CLOSED:
+            self._outcomes.clear()
+        return previous
+
+    def _publish(self, previous, state):
+        # hooks run without the lock, they may use the breaker
+        emit('circuit_breaker', cluster=self.name, state=state, previous=previous)
+
+    def allow(self):
+        """Raise OperationalError when a request to the cluster must not be sent."""
+        previous = None
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                previous = self._transition(HALF_OPEN)
+
+            allowed = self.state == CLOSED or (self.state == HALF_OPEN and self._probing < self.probes)
+            if self.state == HALF_OPEN and allowed:
+                self._probing += 1
+            retry_in = 0.0 if allowed else max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+        if previous is not None:
+            self._publish(previous, HALF_OPEN)
+        if allowed:
+            return
+        metrics.increment('circuit_breaker_rejections')
+        raise OperationalError('{0} is unhealthy, requests are rejected for {1:.0f}s'.format(self.name, retry_in))
+
+    def record(self, failed):
+        """
+        Record the outcome of an allowed request: True when it failed because
+        of the cluster, False when it succeeded, None when unknown, e.g. the
+        request was cancelled.
+        """
+        previous, state = None, None
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = max(0, self._probing - 1)
+                if failed is not None:
+                    state = OPEN if failed else CLOSED
+            elif failed is not None and self.state == CLOSED:
+                self._outcomes.append(failed)
+                failures = sum(self._outcomes)
+                if len(self._outcomes) >= self.min_requests and failures >= self.failure_rate * len(self._outcomes):
+                    state = OPEN
+            if state is not None:
+                previous = self._transition(state)
+
+        if state is not None:
+            self._publish(previous, state)
+
+
+class CircuitBreakers(object):
+    """
+    Circuit breakers by cluster url, created with `settings`, the arguments
+    of `CircuitBreaker`. Changed settings apply to the breakers created
+    after a `reset`.
+    """
+
+    def __init__(self, enabled: bool = True, **settings):
+        self.enabled = enabled
+        self.settings = settings
+        self._breakers = {}
+        self._lock = Lock()
+
+    def get(self, cluster: str):
+        """Return the circuit breaker of a cluster, None when they are disabled."""
+        if not self.enabled:
+            return None
+        breaker = self._breakers.get(cluster)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(cluster)
+                if breaker is None:
+                    breaker = self._breakers[cluster] = CircuitBreaker(cluster, **self.settings)
+        return breaker
+
+    def reset(self):
+        with self._lock:
+            self._breakers.clear()
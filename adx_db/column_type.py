@@ -1,11 +1,17 @@
 
-from sqlalchemy import String, Numeric, INTEGER, DATETIME, FLOAT
+from sqlalchemy import String, Numeric, INTEGER, BIGINT, BOOLEAN, DATETIME, FLOAT
 
 column_type_dict = {
     'string': String,
     'dynamic': String,
+    'guid': String,
+    'timespan': String,
     'int': INTEGER,
+    'long': BIGINT,
+    'real': FLOAT,
+    'decimal': Numeric,
     'number': Numeric,
+    'bool': BOOLEAN,
     'datetime': DATETIME
 }
 
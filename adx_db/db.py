@@ -1,8 +1,17 @@
 
 import logging
-
-from adx_db.exceptions import Error, NotSupportedError, ProgrammingError
-from adx_db.query import execute
+import time
+import uuid
+from contextlib import contextmanager
+from itertools import islice
+
+from adx_db.admission import INTERACTIVE, priority_rank
+from adx_db.budget import WARN, ResultBudget
+from adx_db.execution import DEFAULT_RETRY_POLICY, Cancellation, RetryPolicy
+from adx_db.exceptions import Error, NotSupportedError, OperationalError, ProgrammingError
+from adx_db.query import (PING_TIMEOUT, build_request_properties, drop_stored_result, execute, execute_batch,
+                          explain, fetch_stored_result, ping, store_result)
+from adx_db.result_cache import estimate_rows_size
 
 logger = logging.getLogger(__name__)
 
@@ -12,15 +21,30 @@ def connect(host: str = "",
             path: str = "",
             scheme: str = "https",
             user: str = "",
-            password: str = ""):
+            password: str = "",
+            stored_result_ttl: str = None,
+            result_cache_ttl: float = None,
+            result_cache_path: str = None,
+            timeout: float = None,
+            retry_policy=None,
+            priority: str = INTERACTIVE,
+            max_rows: int = None,
+            max_bytes: int = None,
+            on_budget_exceeded: str = WARN,
+            unauthenticated: bool = False,
+            **request_properties):
     """
     Constructor for creating a connection to the database.
 
         >>> conn = connect()
         >>> curs = conn.cursor()
 
+    The other keyword arguments are request properties of all the queries of
+    the connection, see `adx_db.query.REQUEST_PROPERTIES`.
     """
-    return Connection(host, port, path, scheme, user, password)
+    return Connection(host, port, path, scheme, user, password, stored_result_ttl,
+                      result_cache_ttl, result_cache_path, timeout, retry_policy, priority,
+                      max_rows, max_bytes, on_budget_exceeded, unauthenticated, **request_properties)
 
 
 class Connection(object):
@@ -31,17 +55,84 @@ class Connection(object):
                  path: str = "",
                  scheme: str = "https",
                  user: str = "",
-                 password: str = ""):
+                 password: str = "",
+                 stored_result_ttl: str = None,
+                 result_cache_ttl: float = None,
+                 result_cache_path: str = None,
+                 timeout: float = None,
+                 retry_policy=None,
+                 priority: str = INTERACTIVE,
+                 max_rows: int = None,
+                 max_bytes: int = None,
+                 on_budget_exceeded: str = WARN,
+                 unauthenticated: bool = False,
+                 **request_properties):
         self.host = host
         self.port = port
         self.path = path
         self.scheme = scheme
         self.user = user
         self.password = password
+        # default of `Cursor.stored_result_ttl` for the cursors of this connection
+        self.stored_result_ttl = stored_result_ttl
+        # seconds the results of the queries of this connection are served from
+        # `adx_db.query.result_cache`, and directory of its on-disk tier
+        self.result_cache_ttl = float(result_cache_ttl) if result_cache_ttl else None
+        self.result_cache_path = result_cache_path
+        # seconds after which the queries of this connection are cancelled
+        self.timeout = float(timeout) if timeout else None
+        # a RetryPolicy, or its max number of attempts (1 for no retry) e.g. from the engine url
+        if retry_policy is None:
+            retry_policy = DEFAULT_RETRY_POLICY
+        elif not isinstance(retry_policy, RetryPolicy):
+            retry_policy = RetryPolicy(max_attempts=int(retry_policy))
+        self.retry_policy = retry_policy
+        # `interactive` or `scheduled`, queries of a lower priority wait when
+        # the concurrency limits of `adx_db.query.admission_control` are reached
+        priority_rank(priority)
+        self.priority = priority
+        # rows and bytes read at most for a query of this connection, `warn`
+        # to truncate a result beyond them or `raise` to fail, see `adx_db.budget`
+        self.budget = None
+        if max_rows is not None or max_bytes is not None:
+            self.budget = ResultBudget(max_rows, max_bytes, on_budget_exceeded)
+        # requests sent without credentials, only for a local emulator or
+        # `tests/fake_kusto.py`, `true` from the engine url
+        self.unauthenticated = str(unauthenticated).lower() in ('1', 'true', 'yes')
+        # request properties of the queries of this connection, e.g. `results_cache_max_age=600`
+        build_request_properties(request_properties)  # fail early on unknown or invalid properties
+        self.request_properties = request_properties
 
         self.closed = False
         self.cursors = []
 
+        # health of the connection, updated by `ping`
+        self.stats = {
+            'pings': 0,
+            'ping_failures': 0,
+            'last_ping_latency': None,
+            'last_ping_at': None,
+        }
+
+    def ping(self, timeout: float = PING_TIMEOUT):
+        """
+        Check the cluster answers the cheapest possible query within `timeout`
+        seconds and return its latency in seconds, which is also recorded in
+        `stats`. Raise OperationalError when it does not.
+        """
+        self.stats['pings'] += 1
+        self.stats['last_ping_at'] = time.time()
+        try:
+            latency = ping(self.host, self.port, self.path, self.scheme, self.user, self.password, timeout,
+                           self.unauthenticated)
+        except OperationalError:
+            self.stats['ping_failures'] += 1
+            self.stats['last_ping_latency'] = None
+            raise
+
+        self.stats['last_ping_latency'] = latency
+        return latency
+
     def close(self):
         """Close the connection now."""
         self.closed = True
@@ -51,17 +142,62 @@ class Connection(object):
             except Error:
                 pass  # already closed
 
-    def cursor(self):
+    def cursor(self, stored_result_ttl: str = None):
         """Return a new Cursor Object using the connection."""
         cursor = Cursor(self.host, self.port, self.path, self.scheme,
-                        self.user, self.password)
+                        self.user, self.password,
+                        stored_result_ttl=stored_result_ttl or self.stored_result_ttl,
+                        result_cache_ttl=self.result_cache_ttl,
+                        result_cache_path=self.result_cache_path,
+                        request_properties=self.request_properties,
+                        timeout=self.timeout,
+                        retry_policy=self.retry_policy,
+                        priority=self.priority,
+                        budget=self.budget,
+                        unauthenticated=self.unauthenticated)
         self.cursors.append(cursor)
 
         return cursor
 
-    def execute(self, operation, parameters=None, headers=0):
+    def execute(self, operation, parameters=None, headers=0, request_properties=None, timeout=None, priority=None):
         cursor = self.cursor()
-        return cursor.execute(operation, parameters, headers)
+        return cursor.execute(operation, parameters, headers, request_properties, timeout, priority)
+
+    def execute_many_queries(self, operations, request_properties=None, timeout=None, priority=None):
+        """
+        Execute independent queries in as few round trips as possible and
+        return a cursor holding the result of each one. An operation is a
+        query or an `(operation, parameters)` tuple.
+
+        `request_properties`, `timeout` and `priority` are the ones of
+        `Cursor.execute`. The cursors are added to `cursors` before the
+        queries are sent, `cancel` on any of them cancels the queries.
+        """
+        queries = []
+        for operation in operations:
+            parameters = None
+            if isinstance(operation, (tuple, list)):
+                operation, parameters = operation
+            queries.append(apply_parameters(operation, parameters or {}))
+
+        options = dict(self.request_properties, **(request_properties or {}))
+        cancellation = Cancellation()
+        cursors = [self.cursor() for _ in queries]
+        for cursor in cursors:
+            cursor._cancellation = cancellation
+        try:
+            results = execute_batch(queries, self.host, self.port, self.path, self.scheme, self.user, self.password,
+                                    options, timeout or self.timeout, cancellation, self.retry_policy,
+                                    priority or self.priority, self.budget, self.unauthenticated)
+        finally:
+            for cursor in cursors:
+                cursor._cancellation = None
+
+        for cursor, (rows, description, stats) in zip(cursors, results):
+            cursor._set_results(rows, description)
+            cursor.query_stats = stats
+            cursor.truncated = stats['truncated']
+        return cursors
 
     def commit(self):
         """
@@ -98,6 +234,37 @@ class Cursor(object):
         self.password = password
         self.sql_path = kwargs.get("sql_path")
 
+        # when set to a kusto timespan such as `1h`, `execute` stores the result
+        # on the server for that long and the fetch methods query it page by
+        # page, instead of downloading the whole result at once
+        self.stored_result_ttl = kwargs.get("stored_result_ttl")
+
+        # when set, results are served from the result cache for that many
+        # seconds, see `adx_db.query.execute`
+        self.result_cache_ttl = kwargs.get("result_cache_ttl")
+        self.result_cache_path = kwargs.get("result_cache_path")
+
+        # request properties of the queries of this cursor, completed by the ones passed to `execute`
+        self.request_properties = kwargs.get("request_properties") or {}
+
+        # seconds after which a query is cancelled, unless another timeout is passed to `execute`
+        self.timeout = kwargs.get("timeout")
+
+        # retries of the queries failing with transient errors
+        self.retry_policy = kwargs.get("retry_policy", DEFAULT_RETRY_POLICY)
+
+        # admission priority of the queries, unless another priority is passed to `execute`
+        self.priority = kwargs.get("priority", INTERACTIVE)
+
+        # rows and bytes read at most for a query, see `adx_db.budget`
+        self.budget = kwargs.get("budget")
+
+        # whether the queries are sent without credentials, see `Connection`
+        self.unauthenticated = kwargs.get("unauthenticated", False)
+
+        # cancellation of the query being executed, see `cancel`
+        self._cancellation = None
+
         # This read/write attribute specifies the number of rows to fetch at a
         # time with .fetchmany(). It defaults to 1 meaning to fetch a single
         # row at a time.
@@ -108,31 +275,235 @@ class Cursor(object):
         # this is updated only after a query
         self.description = None
 
-        # this is set to a list of rows after a successful query
+        # statistics of the last query, see `adx_db.statistics`
+        self.query_stats = None
+
+        # whether the result of the last query was truncated to the budget
+        self.truncated = False
+
+        # this is set to a sequence of rows after a successful query, it is
+        # never modified since a cached result is shared by several cursors,
+        # `_position` is the number of rows already fetched
         self._results = None
+        self._position = 0
+
+        # this is set by `execute_page`, so `next_page` reuses its operation and order
+        self._paging = None
+
+        # name of the stored query result of the last query, number of its rows
+        # already fetched and whether all of them were, and the request
+        # properties, timeout and priority of the queries reading it
+        self._stored_result = None
+        self._stored_position = 0
+        self._stored_exhausted = False
+        self._stored_request = ({}, None, INTERACTIVE)
+        # estimated size of the rows read, and whether the cluster truncated the stored result
+        self._stored_size = 0
+        self._stored_truncated = False
 
     @property
     def rowcount(self):
-        return len(self._results)
+        if self._stored_result is not None and not self._stored_exhausted:
+            return -1
+        return len(self._results) - self._position
 
     def close(self):
         """Close the cursor."""
         self.closed = True
+        self._drop_stored_result()
 
-    def execute(self, operation, parameters=None, headers=0):
-        print('operation: {} parameters: {} headers: {}'.format(operation, parameters, headers))
+    def _drop_stored_result(self):
+        if self._stored_result is None:
+            return
 
+        name, self._stored_result = self._stored_result, None
+        options, timeout, priority = self._stored_request
+        try:
+            with self._cancellable() as cancellation:
+                drop_stored_result(name, self.host, self.port, self.path, self.scheme, self.user, self.password,
+                                   options, timeout, cancellation, priority, self.unauthenticated)
+        except Exception as e:
+            # it expires after `stored_result_ttl` anyway
+            logger.warning('Fail to drop stored query result %s: %s', name, e)
+
+    @contextmanager
+    def _cancellable(self):
+        """
+        The cancellation of the query being executed, or one of its own for
+        the requests of the block, so that `cancel` stops them too.
+        """
+        if self._cancellation is not None:
+            yield self._cancellation
+            return
+        self._cancellation = cancellation = Cancellation()
+        try:
+            yield cancellation
+        finally:
+            self._cancellation = None
+
+    def _fill(self, size=None):
+        """
+        In stored result mode, query the rows missing to serve `size` rows (all
+        rows when None), reading at least `arraysize` rows per round trip.
+        """
+        if self._stored_result is None or self._stored_exhausted:
+            return
+
+        missing = None
+        if size is not None:
+            missing = size - (len(self._results) - self._position)
+            if missing <= 0:
+                return
+            missing = max(missing, self.arraysize)
+
+        options, timeout, priority = self._stored_request
+        with self._cancellable() as cancellation:
+            rows, self.description = fetch_stored_result(
+                self._stored_result, self._stored_position, missing,
+                self.host, self.port, self.path, self.scheme, self.user, self.password,
+                options, timeout, cancellation, self.retry_policy, priority, self.unauthenticated)
+
+        if missing is None or len(rows) < missing:
+            self._stored_exhausted = True
+        if self.budget is not None:
+            try:
+                rows, truncated = self.budget.apply(
+                    rows, self._stored_exhausted and self._stored_truncated, self._stored_position, self._stored_size)
+            except Error:
+                self._drop_stored_result()
+                raise
+            if truncated:
+                # nothing is read beyond the budget
+                self._stored_exhausted = self.truncated = True
+                if self.query_stats is not None:
+                    self.query_stats['truncated'] = True
+            self._stored_size += estimate_rows_size(rows)
+
+        self._stored_position += len(rows)
+        self._results = self._results[self._position:] + rows
+        self._position = 0
+
+    def execute(self, operation, parameters=None, headers=0, request_properties=None, timeout=None, priority=None):
+        """
+        Execute a query, `request_properties` override the request properties
+        of the connection for this query, e.g. `{'no_truncation': True}`, and
+        `priority` its admission priority.
+
+        OperationalError is raised when the query fails, is cancelled by
+        `cancel` or is not done after `timeout` (default to the connection's
+        timeout) seconds.
+
+        A result beyond the budget of the connection is truncated, which sets
+        `truncated`, or raises OperationalError, see `adx_db.budget`.
+        """
+        return self._execute(operation, parameters, headers, request_properties=request_properties, timeout=timeout,
+                             priority=priority)
+
+    def explain(self, operation, parameters=None, plan=False, request_properties=None, timeout=None):
+        """
+        Return what `execute` would send for a query without executing it, a
+        dict with the preprocessed query (`sql`), its kql (`kql`), the rewrite
+        passes which changed it (`rewrites`) and, with `plan`, the query plan
+        of the cluster (`plan`), see `adx_db.query.explain`. The results of
+        the cursor are left as they are.
+        """
+        query = apply_parameters(operation, parameters or {})
+        options = dict(self.request_properties, **(request_properties or {}))
+        with self._cancellable() as cancellation:
+            return explain(query, self.host, self.port, self.path, self.scheme, self.user, self.password,
+                           plan=plan, budget=self.budget, options=options, timeout=timeout or self.timeout,
+                           cancellation=cancellation, priority=self.priority, unauthenticated=self.unauthenticated)
+
+    def cancel(self):
+        """
+        Cancel the query being executed by another thread, on the client and
+        on the server.
+        """
+        cancellation = self._cancellation
+        if cancellation is not None:
+            cancellation.cancel()
+
+    def execute_page(self, operation, page=0, page_size=None, parameters=None, order_by=None, headers=0):
+        """
+        Execute a select statement for one page of its rows, only the rows of
+        that page are returned by the server.
+
+        Pages are numbered from 0 and have `page_size` rows (default to the
+        cursor's arraysize). The rows are ordered by the ORDER BY of the
+        statement, else by `order_by`, else by its selected columns, so that
+        every page is taken from the same ordering.
+        """
+        page_size = page_size or self.arraysize
+        self._paging = (operation, parameters, headers, page_size, order_by, page)
+        return self._execute(operation, parameters, headers, page=(page * page_size, page_size, order_by))
+
+    def next_page(self):
+        """Execute the page following the last one executed by `execute_page`."""
+        if self._paging is None:
+            raise ProgrammingError('`next_page` must follow a call to `execute_page`')
+        operation, parameters, headers, page_size, order_by, page = self._paging
+        return self.execute_page(operation, page + 1, page_size, parameters, order_by, headers)
+
+    def _execute(self, operation, parameters=None, headers=0, page=None, request_properties=None, timeout=None,
+                 priority=None):
         self.description = None
+        self.query_stats = None
+        self.truncated = False
+        self._drop_stored_result()
         query = apply_parameters(operation, parameters or {})
+        options = dict(self.request_properties, **(request_properties or {}))
+        self._cancellation = cancellation = Cancellation()
+        timeout = timeout or self.timeout
+        priority = priority or self.priority
+        stats = {}
 
         try:
-            self._results, self.description = execute(
-                query, headers, self.host, self.port, self.path, self.scheme, self.user, self.password)
-        except (ProgrammingError, NotSupportedError) as e:
-            print('e', e)
+            if self.stored_result_ttl and page is None:
+                self._store_result(query, options, timeout, cancellation, priority, stats)
+                stats['truncated'] = self.truncated
+            else:
+                self._results, self.description = execute(
+                    query, headers, self.host, self.port, self.path, self.scheme, self.user, self.password,
+                    page=page, cache_ttl=self.result_cache_ttl, cache_path=self.result_cache_path,
+                    options=options, timeout=timeout, cancellation=cancellation, retry_policy=self.retry_policy,
+                    priority=priority, budget=self.budget, stats=stats, unauthenticated=self.unauthenticated)
+                self.truncated = stats.get('truncated', False)
+                self._position = 0
+            self.query_stats = stats
+        except Error:
+            # no result of a previous query is left to fetch
+            self._drop_stored_result()
+            self._results, self._position, self.description = [], 0, None
+            raise
+        finally:
+            self._cancellation = None
 
         return self
 
+    def _set_results(self, results, description):
+        self._drop_stored_result()
+        self._results, self.description = results, description
+        self._position = 0
+
+    def _store_result(self, query, options=None, timeout=None, cancellation=None, priority=INTERACTIVE,
+                      stats=None):
+        name = 'adx_db_{0}'.format(uuid.uuid4().hex)
+        store_result(name, self.stored_result_ttl, query,
+                     self.host, self.port, self.path, self.scheme, self.user, self.password, options,
+                     timeout, cancellation, priority, stats, self.budget, self.unauthenticated)
+
+        self._stored_result = name
+        self._stored_position = 0
+        self._stored_exhausted = False
+        self._stored_request = (options, timeout, priority)
+        self._stored_size = 0
+        self._stored_truncated = bool(stats and stats.get('partial_failure'))
+        self._results = []
+        self._position = 0
+
+        # first page, which also sets the description
+        self._fill(self.arraysize)
+
     def executemany(self, operation, seq_of_parameters=None):
         raise NotSupportedError('`executemany` is not supported, use `execute` instead')
 
@@ -141,10 +512,11 @@ class Cursor(object):
         Fetch the next row of a query result set, returning a single sequence,
         or `None` when no more data is available.
         """
-        try:
-            return self._results.pop(0)
-        except IndexError:
+        self._fill(1)
+        if self._position >= len(self._results):
             return None
+        self._position += 1
+        return self._results[self._position - 1]
 
     def fetchmany(self, size=None):
         """
@@ -153,8 +525,9 @@ class Cursor(object):
         no more rows are available.
         """
         size = size or self.arraysize
-        out = self._results[:size]
-        self._results = self._results[size:]
+        self._fill(size)
+        out = list(self._results[self._position:self._position + size])
+        self._position += len(out)
         return out
 
     def fetchall(self):
@@ -163,8 +536,9 @@ class Cursor(object):
         sequence of sequences (e.g. a list of tuples). Note that the cursor's
         arraysize attribute can affect the performance of this operation.
         """
-        out = self._results[:]
-        self._results = []
+        self._fill()
+        out = list(self._results[self._position:])
+        self._position = len(self._results)
         return out
 
     def setinputsizes(self, sizes):
@@ -176,7 +550,9 @@ class Cursor(object):
         pass
 
     def __iter__(self):
-        return iter(self._results)
+        if self._stored_result is not None:
+            return iter(self.fetchone, None)
+        return islice(self._results, self._position, None)
 
 
 def apply_parameters(operation, parameters):
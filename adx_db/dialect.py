@@ -1,8 +1,20 @@
 
 
+import logging
+from threading import Lock, Thread
+
+from sqlalchemy import String
 from sqlalchemy.engine import default
+from sqlalchemy.exc import NoSuchTableError
 
 import adx_db
+from adx_db.column_type import column_type_dict
+from adx_db.instrumentation import redact
+from adx_db.metadata import (DEFAULT_METADATA_CACHE_TTL, DiskMetadataCache, MetadataCache, parse_schema,
+                             schema_command)
+from adx_db.query import PING_TIMEOUT
+
+logger = logging.getLogger(__name__)
 
 
 class AdxDialect(default.DefaultDialect):
@@ -13,20 +25,46 @@ class AdxDialect(default.DefaultDialect):
     scheme = "https"
     driver = "rest"
 
-    def __init__(self, *args, **kwargs):
-        super(AdxDialect, self).__init__(*args, **kwargs)
+    # compiled statements can be cached by sqlalchemy 1.4 and later (ignored by
+    # 1.3), their sql text is then identical from one execution to the next
+    # and its kql is served from the translation cache of
+    # `adx_db.query.translate_query`
+    supports_statement_cache = True
+
+    def __init__(self, metadata_cache_ttl=DEFAULT_METADATA_CACHE_TTL, metadata_cache_path=None,
+                 ping_timeout=PING_TIMEOUT, **kwargs):
+        super(AdxDialect, self).__init__(**kwargs)
+        # seconds `do_ping` waits for the cluster, e.g. `create_engine(..., pool_pre_ping=True, ping_timeout=2)`
+        self.ping_timeout = float(ping_timeout)
+
+        # schemas used by the reflection methods, e.g.
+        # `create_engine('adx://...', metadata_cache_ttl=600, metadata_cache_path='/tmp/adx_db')`
+        self.metadata_cache = MetadataCache(float(metadata_cache_ttl))
+        self.disk_metadata_cache = None
+        if metadata_cache_path:
+            self.disk_metadata_cache = DiskMetadataCache(metadata_cache_path, float(metadata_cache_ttl))
+
+        # databases whose stale schema from disk is being fetched again in the background
+        self._revalidating = set()
+        self._revalidating_lock = Lock()
 
     @classmethod
     def dbapi(cls):
         return adx_db
 
     def do_ping(self, dbapi_connection):
+        """
+        Pool pre-ping: a connection whose cluster fails or is slower than
+        `ping_timeout` seconds to answer is replaced instead of being used.
+        """
+        try:
+            dbapi_connection.ping(self.ping_timeout)
+        except adx_db.OperationalError as e:
+            logger.warning('Ping failed, the connection is invalidated: %s', e)
+            return False
         return True
 
     def create_connect_args(self, url):
-
-        # print(url)
-
         kwargs = {
             "host": url.host,
             "port": url.port or 443,
@@ -36,11 +74,11 @@ class AdxDialect(default.DefaultDialect):
             "password": url.password or None,
         }
 
-        print(kwargs)
         if url.query:
             kwargs.update(url.query)
 
-        print('kwargs', kwargs)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Connect arguments: %s', redact(kwargs))
         return ([], kwargs)
     #
     # def get_schema_names(self, connection, **kwargs):
@@ -54,26 +92,96 @@ class AdxDialect(default.DefaultDialect):
     #     return [row[0] for row in result.fetchall()]
     #
 
+    def _get_schema(self, connection, schema=None):
+        """
+        Return the tables, views and columns of the database (`schema` or the
+        database of the engine url), fetched in one control command and cached.
+        """
+        database = schema or connection.engine.url.database.split('/')[-1]
+        cluster = connection.engine.url.host
+
+        def load():
+            if self.disk_metadata_cache is None:
+                return self._fetch_schema(connection, database)
+
+            cached = self.disk_metadata_cache.get(cluster, database)
+            if cached is None:
+                database_schema = self._fetch_schema(connection, database)
+                self.disk_metadata_cache.set(cluster, database, database_schema)
+                return database_schema
+
+            database_schema, fresh = cached
+            if not fresh:
+                self._revalidate(connection.engine, cluster, database, database_schema)
+            return database_schema
+
+        return self.metadata_cache.get(database, load)
+
+    def _fetch_schema(self, connection, database, if_later_than=None):
+        rows = connection.execute(schema_command(database, if_later_than)).fetchall()
+        return parse_schema(rows[0][0]) if rows else parse_schema({})
+
+    def _revalidate(self, engine, cluster, database, database_schema):
+        """
+        Refresh a stale schema read from disk in a background thread, the
+        schema is only transferred again when its version changed.
+        """
+        with self._revalidating_lock:
+            if database in self._revalidating:
+                return
+            self._revalidating.add(database)
+
+        def run():
+            try:
+                with engine.connect() as connection:
+                    new_schema = self._fetch_schema(connection, database, database_schema['version'])
+                if new_schema['version'] is None:
+                    new_schema = database_schema  # unchanged
+                self.disk_metadata_cache.set(cluster, database, new_schema)
+                self.metadata_cache.set(database, new_schema)
+            except Exception as e:
+                logger.warning('Fail to revalidate the schema of %s: %s', database, e)
+            finally:
+                with self._revalidating_lock:
+                    self._revalidating.discard(database)
+
+        Thread(target=run, name='adx_db-revalidate-{0}'.format(database), daemon=True).start()
+
+    def invalidate_metadata(self, schema=None):
+        """Make the next reflection fetch the schema of `schema`, or of all databases, again."""
+        self.metadata_cache.invalidate(schema)
+        if self.disk_metadata_cache is not None:
+            self.disk_metadata_cache.invalidate(schema)
+
     def has_table(self, connection, table_name, schema=None):
         return table_name in self.get_table_names(connection, schema)
 
     def get_table_names(self, connection, schema=None, **kwargs):
-        return ['customEvents']
+        return sorted(self._get_schema(connection, schema)['tables'])
 
     def get_view_names(self, connection, schema=None, **kwargs):
-        return []
+        return sorted(self._get_schema(connection, schema)['views'])
 
     def get_table_options(self, connection, table_name, schema=None, **kwargs):
         return {}
 
     def get_columns(self, connection, table_name, schema=None, **kwargs):
-        query = 'SELECT * FROM {table} LIMIT 1'.format(table=table_name)
-        print('get_columns query', query)
-        result = connection.execute(query)
+        database_schema = self._get_schema(connection, schema)
+        if table_name in database_schema['tables']:
+            columns = database_schema['tables'][table_name]
+        elif table_name in database_schema['views']:
+            columns = database_schema['views'][table_name]
+        else:
+            raise NoSuchTableError(table_name)
 
-        print('result', result)
         return [
-            {'name': item[0], 'type': item[1]} for item in result._cursor_description()
+            {
+                'name': name,
+                'type': column_type_dict.get(kusto_type, String)(),
+                'nullable': True,
+                'default': None,
+            }
+            for name, kusto_type in columns
         ]
 
     def get_pk_constraint(self, connection, table_name, schema=None, **kwargs):
@@ -0,0 +1,209 @@
+import logging
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+
+import requests
+from azure.kusto.data import ClientRequestProperties
+from azure.kusto.data.exceptions import KustoServiceError
+
+from adx_db.exceptions import OperationalError
+from adx_db.instrumentation import emit, metrics
+from adx_db.statistics import format_timespan
+
+logger = logging.getLogger(__name__)
+
+# max number of requests sent to the clusters at the same time by the process
+QUERY_THREADS = 128
+
+# http statuses of the throttling and transient failures of a cluster
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+
+# requests run on these threads, so the thread executing a query is released
+# as soon as the query is cancelled or times out
+_executor = ThreadPoolExecutor(max_workers=QUERY_THREADS, thread_name_prefix='adx_db-query')
+
+
+class Cancellation(object):
+    """
+    Cancellation of the query of a cursor, requested from any thread by
+    `Cursor.cancel`.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        # cancelled because the callers waiting for the query timed out, not by a user
+        self.timed_out = False
+        self._callbacks = []
+        self._lock = Lock()
+
+    def cancel(self, timed_out: bool = False):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            self.timed_out = timed_out
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """Call `callback()` when the query is cancelled, at once if it already is."""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+
+class QueryTimeout(OperationalError):
+    """A query not done within its timeout."""
+
+
+def retry_after(error):
+    """Return the seconds to wait before a retry asked by the server with a failure, or None."""
+    response = getattr(error, 'http_response', None)
+    try:
+        return float(response.headers['Retry-After'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+def is_transient(error):
+    """Whether a failed request may succeed if it is sent again."""
+    if isinstance(error, KustoServiceError):
+        return getattr(error.http_response, 'status_code', None) in TRANSIENT_STATUSES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+class RetryPolicy(object):
+    """
+    Retries of the queries failing with throttling or transient errors, up
+    to `max_attempts` attempts in all. The delay before a retry is random
+    between 0 and `base_delay * 2 ** retry` seconds, capped at `max_delay`
+    (exponential backoff with full jitter), or the delay asked by the server.
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 10):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, retry: int, error):
+        """Return the seconds to wait before the retry number `retry` (from 0) of a failure, None for no retry."""
+        if retry + 1 >= self.max_attempts or not is_transient(error):
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+        return max(delay, retry_after(error) or 0)
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def sleep(delay: float, cancellation: Cancellation = None):
+    """Wait for `delay` seconds, raise OperationalError when the query is cancelled first."""
+    event = Event()
+    if cancellation is not None:
+        cancellation.on_cancel(event.set)
+    event.wait(delay)
+    if cancellation is not None and cancellation.cancelled:
+        raise OperationalError('Query cancelled')
+
+
+def wait(event: Event, timeout: float = None, cancellation: Cancellation = None):
+    """
+    Wait for `event`, raise OperationalError when `timeout` seconds pass or
+    the query is cancelled first.
+    """
+    if cancellation is not None:
+        cancellation.on_cancel(event.set)
+    if not event.wait(timeout):
+        raise QueryTimeout('Query timed out after {0}s'.format(timeout))
+    if cancellation is not None and cancellation.cancelled:
+        raise OperationalError('Query cancelled')
+
+
+class Execution(object):
+    """
+    A request to a cluster. The thread waiting for it gives up after its
+    timeout or when it is cancelled, and the query is then cancelled on the
+    server with its client request id.
+    """
+
+    def __init__(self, client, database: str, query: str, properties: ClientRequestProperties = None):
+        self.client = client
+        self.database = database
+        self.query = query
+        self.properties = properties or ClientRequestProperties()
+        self.client_request_id = None
+        self.retries = 0
+
+    @property
+    def is_command(self):
+        return self.query.lstrip().startswith('.')
+
+    def run(self, timeout: float = None, cancellation: Cancellation = None, retry_policy: RetryPolicy = None):
+        """
+        Return the response of the cluster, raise OperationalError on failure.
+        Queries, but not control commands which may not be idempotent, are
+        sent again on transient failures according to `retry_policy`, within
+        `timeout`.
+        """
+        if timeout and not self.properties.has_option(ClientRequestProperties.request_timeout_option_name):
+            # the server stops working on the query too
+            self.properties.set_option(ClientRequestProperties.request_timeout_option_name,
+                                       format_timespan(timeout))
+        deadline = time.monotonic() + timeout if timeout else None
+
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                return self._attempt(remaining, cancellation)
+            except OperationalError as e:
+                delay = None
+                if retry_policy is not None and not self.is_command:
+                    delay = retry_policy.delay(self.retries, e.__cause__)
+                if delay is None or (deadline is not None and time.monotonic() + delay >= deadline):
+                    raise
+                error = e
+
+            self.retries += 1
+            metrics.increment('query_retries')
+            emit('query_retry', client_request_id=self.client_request_id, retry=self.retries, delay=delay,
+                 error=error)
+            logger.info('Retry %s of query %s in %.2fs: %s', self.retries, self.client_request_id, delay, error)
+            sleep(delay, cancellation)
+
+    def _attempt(self, timeout: float = None, cancellation: Cancellation = None):
+        # every request has its own id, used to cancel it
+        self.client_request_id = 'adx_db;{0}'.format(uuid.uuid4())
+        self.properties.client_request_id = self.client_request_id
+
+        done = Event()
+        future = _executor.submit(self.client.execute, self.database, self.query, self.properties)
+        future.add_done_callback(lambda _: done.set())
+        try:
+            wait(done, timeout, cancellation)
+        except OperationalError:
+            if not future.done():
+                self.cancel_on_server()
+            raise
+
+        try:
+            return future.result()
+        except Exception as e:
+            raise OperationalError('Query failed: {0}'.format(e)) from e
+
+    def cancel_on_server(self):
+        if self.is_command:
+            return  # control commands cannot be cancelled
+
+        command = '.cancel query "{0}"'.format(self.client_request_id)
+        future = _executor.submit(self.client.execute, self.database, command)
+        future.add_done_callback(self._log_cancel_failure)
+
+    def _log_cancel_failure(self, future):
+        if future.exception() is not None:
+            logger.warning('Fail to cancel query %s: %s', self.client_request_id, future.exception())
@@ -8,6 +8,7 @@
 #
 
 import re
+from json import dumps
 
 from mo_future import string_types, text, first, long, is_text
 
@@ -17,6 +18,12 @@ from adx_db.keywords import (RESERVED, kusto_reserved_keywords, join_keywords,
 
 VALID = re.compile(r'^[a-zA-Z_]\w*$')
 
+# column added by `Formatter.offset` to number the rows of a page
+ROW_NUMBER = '__row_number'
+
+# `IN (...)` lists with at least this many values are bound to a let statement
+IN_LIST_LET_SIZE = 1000
+
 
 def format(json, **kwargs):
     return Formatter(**kwargs).format(json)
@@ -63,6 +70,53 @@ def join_field(path):
     return output if output else "."
 
 
+def count_references(json, name, skip=None):
+    """
+    Return how many times the table `name` is read by a parsed query, as a
+    `from`/`join` source of it or of its subqueries and union members,
+    `skip` is a top level clause to leave out.
+    """
+    if isinstance(json, list):
+        return sum(count_references(v, name) for v in json)
+    if isinstance(json, dict):
+        return sum(
+            count_sources(v, name) if k == 'from' else count_references(v, name)
+            for k, v in json.items()
+            if k not in ('name', 'literal', skip)
+        )
+    return 0
+
+
+def count_sources(sources, name):
+    """
+    Return how many of the `from` sources, joined tables included, are the
+    table `name`; subqueries are counted with `count_references`.
+    """
+    if isinstance(sources, string_types):
+        return 1 if sources == name else 0
+    if isinstance(sources, list):
+        return sum(count_sources(s, name) for s in sources)
+    if isinstance(sources, dict) and any(k == 'value' or k.endswith('join') for k in sources):
+        return sum(
+            count_sources(v, name) if k == 'value' or k.endswith('join') else count_references(v, name)
+            for k, v in sources.items()
+            if k != 'name'
+        )
+    return count_references(sources, name)
+
+
+def default_column_name(aggregate):
+    """
+    Return the name kusto gives to an aggregate summarized without an alias,
+    e.g. `count_` for `count()` and `sum_itemCount` for `sum(itemCount)`, or
+    None when it is not predictable.
+    """
+    match = re.match(r'^(\w+)\((\w*)\)$', aggregate)
+    if match:
+        return '{0}_{1}'.format(*match.groups())
+    return None
+
+
 def escape(ident, ansi_quotes, should_quote):
     """
     Escape identifiers.
@@ -111,11 +165,11 @@ class Formatter:
         'with_',
         'from_',
         'where',
-        'having',
-        'offset',
         'project',
         'groupby',
+        'having',
         'orderby',
+        'offset',
         'limit',
     ]
 
@@ -137,18 +191,38 @@ class Formatter:
     _binary_and = Operator("&")
     _binary_or = Operator("|")
 
-    def __init__(self, ansi_quotes=True, should_quote=should_quote):
+    def __init__(self, ansi_quotes=True, should_quote=should_quote, in_list_let_size=IN_LIST_LET_SIZE):
         self.ansi_quotes = ansi_quotes
         self.should_quote = should_quote
+        self.in_list_let_size = in_list_let_size
+
+        # let statements to put before the query being formatted, None outside `format`
+        self._lets = None
 
     def format(self, json):
+        if self._lets is not None:
+            # nested query
+            return self.statement(json)
+
+        self._lets = []
+        try:
+            res = self.statement(json)
+            lets = self._lets
+        finally:
+            self._lets = None
+        return ' '.join(lets + [res])
+
+    def statement(self, json):
         if 'union' in json:
-            return self.union(json['union'])
+            union = self.union(json['union'])
         elif 'union_all' in json:
-            return self.union_all(json['union_all'])
+            union = self.union_all(json['union_all'])
         else:
             return self.query(json)
 
+        with_ = self.with_(json)
+        return '{0} {1}'.format(with_, union) if with_ else union
+
     def dispatch(self, json):
         if isinstance(json, list):
             return self.delimited_list(json)
@@ -167,6 +241,8 @@ class Formatter:
                 return self.op(json)
         if isinstance(json, string_types):
             return escape(json, self.ansi_quotes, self.should_quote)
+        if isinstance(json, bool):
+            return 'true' if json else 'false'
 
         return text(json)
 
@@ -266,25 +342,32 @@ class Formatter:
     def _is(self, pair):
         return '{0} is {1}'.format(self.dispatch(pair[0]), self.dispatch(pair[1]))
 
-    def _in(self, json):
-        # print('in', json)
-        valid = self.dispatch(json[1])
-        # print('valid', valid)
+    def in_list(self, json):
+        """
+        Format the values of in / not in, a list of at least `in_list_let_size`
+        literals is bound once to a dynamic array with let instead of being inlined.
+        """
+        values = json['literal'] if isinstance(json, dict) and list(json.keys()) == ['literal'] else json
+        if (isinstance(values, list)
+                and len(values) >= self.in_list_let_size
+                and self._lets is not None
+                and all(isinstance(v, (text, int, float)) for v in values)):
+            name = '__in_list_{0}'.format(len(self._lets))
+            self._lets.append('let {0} = dynamic({1});'.format(name, dumps(values, ensure_ascii=False)))
+            return '({0})'.format(name)
+
+        valid = self.dispatch(json)
         # `(10, 11, 12)` does not get parsed as literal, so it's formatted as
         # `10, 11, 12`. This fixes it.
         if not valid.startswith('('):
             valid = '({0})'.format(valid)
+        return valid
 
-        return '{0} in {1}'.format(self.dispatch(json[0]), valid)
+    def _in(self, json):
+        return '{0} in {1}'.format(self.dispatch(json[0]), self.in_list(json[1]))
 
     def _nin(self, json):
-        valid = self.dispatch(json[1])
-        # `(10, 11, 12)` does not get parsed as literal, so it's formatted as
-        # `10, 11, 12`. This fixes it.
-        if not valid.startswith('('):
-            valid = '({0})'.format(valid)
-
-        return '{0} not in {1}'.format(json[0], valid)
+        return '{0} not in {1}'.format(json[0], self.in_list(json[1]))
 
     def _case(self, checks):
         parts = []
@@ -331,6 +414,13 @@ class Formatter:
             join_keyword.upper(), self.dispatch(json[join_keyword]), self.dispatch(json['on'])
         )
 
+    def _union(self, json):
+        # union used as a source, e.g. `SELECT * FROM (... UNION ALL ...) AS expr_qry`
+        return '({0})'.format(self.union(json))
+
+    def _union_all(self, json):
+        return '({0})'.format(self.union_all(json))
+
     def union(self, json):
         return '(' + ') | union ('.join(self.query(query) for query in json) + ')'
 
@@ -350,15 +440,27 @@ class Formatter:
         return res
 
     def with_(self, json):
+        """
+        Common table expressions become kql let statements, a CTE referenced
+        more than once is wrapped in materialize() so kusto evaluates it once, e.g.
+        `WITH a AS (SELECT ...) SELECT ... FROM a JOIN a ...` becomes `let a = materialize(...); ...`
+        """
         if 'with' in json:
             with_ = json['with']
             if not isinstance(with_, list):
                 with_ = [with_]
-            parts = ', '.join(
-                '{0} AS {1}'.format(part['name'], self.dispatch(part['value']))
-                for part in with_
-            )
-            return 'WITH {0}'.format(parts)
+
+            parts = []
+            for i, part in enumerate(with_):
+                # a CTE can be used by the main query and by the CTEs following it
+                references = count_references(json, part['name'], skip='with') + sum(
+                    count_references(later['value'], part['name']) for later in with_[i + 1:])
+
+                value = self.format(part['value'])
+                if references > 1:
+                    value = 'materialize({0})'.format(value)
+                parts.append('let {0} = {1};'.format(part['name'], value))
+            return ' '.join(parts)
 
     def select(self, json):
         if 'select' in json:
@@ -434,15 +536,68 @@ class Formatter:
                 # agg = '{}'.format(self.dispatch(each))
                 res_list.append(each)
 
+            # aggregates only used in the having clause are summarized under generated aliases
+            res_list.extend(self._having_aggregates(json)[1])
+
             # print('self.dispatch(res_list)', self.dispatch(res_list))
             if res_list:
                 return '| summarize {} by {}'.format(self.dispatch(res_list).replace('"', ''), self.dispatch(groupby))
             else:
                 return '| summarize by {}'.format(self.dispatch(select)).replace('"', '')
 
+    def _having_aggregates(self, json):
+        """
+        Map the aggregates of the having clause to the aliases of the summarized columns.
+
+        :return: the rewritten having clause, and the `{'value', 'name'}` columns
+                 to add to the summarize for aggregates without an alias in select
+        """
+        if 'having' not in json:
+            return None, []
+
+        select_ = json.get('select', [])
+        if not isinstance(select_, list):
+            select_ = [select_]
+        aliases = [(item['value'], item['name']) for item in select_
+                   if isinstance(item, dict) and 'name' in item]
+        # an aggregate selected without an alias is reused under the name kusto gives it
+        for item in select_:
+            if isinstance(item, dict) and 'name' not in item and isinstance(item['value'], dict) \
+                    and list(item['value'].keys())[0].lower() in AGGREGATE_FUNCTIONS:
+                name = default_column_name(self.dispatch(item['value']).replace('"', ''))
+                if name is not None:
+                    aliases.append((item['value'], name))
+        hidden = []
+
+        def replace(expr):
+            if isinstance(expr, list):
+                return [replace(v) for v in expr]
+            if not isinstance(expr, dict) or not expr:
+                return expr
+            if list(expr.keys())[0].lower() in AGGREGATE_FUNCTIONS:
+                for value, name in aliases:
+                    if value == expr:
+                        return name
+                for item in hidden:
+                    if item['value'] == expr:
+                        return item['name']
+                hidden.append({'value': expr, 'name': '__having_{0}'.format(len(hidden))})
+                return hidden[-1]['name']
+            return {k: replace(v) for k, v in expr.items()}
+
+        return replace(json['having']), hidden
+
     def having(self, json):
+        """
+        kql has no HAVING, so filter the output of the summarize instead, e.g.
+        `HAVING count(*) > 5` becomes `| where cnt > 5` when `count(*) AS cnt` is selected.
+        """
         if 'having' in json:
-            return 'HAVING {0}'.format(self.dispatch(json['having']))
+            having, hidden = self._having_aggregates(json)
+            res = '| where {0}'.format(self.dispatch(having))
+            if hidden:
+                res += ' | project-away {0}'.format(', '.join(item['name'] for item in hidden))
+            return res
 
     def orderby(self, json):
         if 'orderby' in json:
@@ -455,13 +610,20 @@ class Formatter:
             ]))
 
     def limit(self, json):
-        if 'limit' in json:
+        if 'limit' in json and 'offset' not in json:
             if json['limit'] >= 0:
                 return '| limit {0}'.format(self.dispatch(json['limit']))
 
     def offset(self, json):
+        """
+        kql has no OFFSET, so number the (ordered) rows and keep only the requested window,
+        the limit is folded into the window so only that page is returned by the server.
+        """
         if 'offset' in json:
-            return 'OFFSET {0}'.format(self.dispatch(json['offset']))
+            window = '{0} > {1}'.format(ROW_NUMBER, self.dispatch(json['offset']))
+            if 'limit' in json and json['limit'] >= 0:
+                window += ' and {0} <= {1}'.format(ROW_NUMBER, self.dispatch(json['offset'] + json['limit']))
+            return '| serialize {0}=row_number() | where {1} | project-away {0}'.format(ROW_NUMBER, window)
 
     def project(self, json):
         if 'groupby' in json:
@@ -490,11 +652,15 @@ class Formatter:
                         operate_plugins.append(item)
                     else:
                         scalar_columns.append(item)
+                elif isinstance(item['value'], (int, float)):
+                    # constant column, e.g. folded by `adx_db.simplify`
+                    scalar_columns.append(item)
                 else:
                     raise ValueError
 
             # if there is no groupby clause in sql, most one of following list not empty
             if aggregate_columns:
+                select = select + self._having_aggregates(json)[1]
                 value = '| summarize {0}'.format(self.dispatch(select)).replace('"', '')  # summarize not need escape
 
             if scalar_columns:
@@ -0,0 +1,107 @@
+import logging
+import random
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+# names of the connection arguments whose value is never logged
+SECRETS = ('password', 'secret', 'token')
+
+
+class Metrics(object):
+    """
+    Counters and observed values of the process, e.g. the number of queries
+    coalesced or the seconds spent waiting for a slot.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._observations = {}  # name -> [count, total, max]
+        self._lock = Lock()
+
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            observation = self._observations.setdefault(name, [0, 0, value])
+            observation[0] += 1
+            observation[1] += value
+            observation[2] = max(observation[2], value)
+
+    def snapshot(self):
+        """
+        Return `{name: count}` for the counters and
+        `{name: {'count': .., 'total': .., 'max': ..}}` for the observed values.
+        """
+        with self._lock:
+            snapshot = dict(self._counters)
+            for name, (count, total, maximum) in self._observations.items():
+                snapshot[name] = {'count': count, 'total': total, 'max': maximum}
+            return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._observations.clear()
+
+
+metrics = Metrics()
+
+# callables called with `(event, data)` by `emit`
+_hooks = []
+
+
+def add_hook(hook):
+    """
+    Call `hook(event, data)` for the events of adx_db, a hook must be quick
+    since it runs on the thread executing the query.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def emit(event: str, **data):
+    for hook in list(_hooks):
+        try:
+            hook(event, data)
+        except Exception:
+            logger.exception('Instrumentation hook %r failed on %s', hook, event)
+
+
+def redact(arguments: dict):
+    """Return a copy of connection arguments fit for the logs, without their secrets."""
+    return {
+        name: '***' if value and any(secret in name.lower() for secret in SECRETS) else value
+        for name, value in arguments.items()
+    }
+
+
+class QueryLog(object):
+    """
+    Log of a sample of the requests sent to the clusters, to the
+    `adx_db.queries` logger at INFO with their kql, duration and statistics.
+    Disabled by default, it is enabled at runtime by setting `sample_rate`,
+    e.g. `query_log.sample_rate = 0.01` to log one request in a hundred.
+    """
+
+    def __init__(self, sample_rate: float = 0.0):
+        self.sample_rate = sample_rate
+        self.logger = logging.getLogger('adx_db.queries')
+
+    def sampled(self):
+        """Whether the request being sent is logged, a single comparison when the log is disabled."""
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def record(self, query: str, duration: float, error: Exception = None, **data):
+        if error is not None:
+            self.logger.info('Query failed after %.3fs: %s | %s | %s', duration, query, data, error)
+        else:
+            self.logger.info('Query done in %.3fs: %s | %s', duration, query, data)
+
+
+query_log = QueryLog()
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import re
+import time
+from threading import Lock
+
+from adx_db.utils import atomic_write
+
+# seconds a database schema is served from the cache before it is fetched again
+DEFAULT_METADATA_CACHE_TTL = 300
+
+# layout of the files written by `DiskMetadataCache`, files of another layout are ignored
+DISK_CACHE_FORMAT = 1
+
+VALID = re.compile(r'^[a-zA-Z_]\w*$')
+
+
+def schema_command(database: str, if_later_than: str = None):
+    """
+    Return the control command fetching the schema of all the tables of a
+    database in one round trip, with `if_later_than` (a schema version such
+    as `v3.7`) the command returns nothing when the schema did not change.
+    """
+    if not VALID.match(database):
+        database = '["{0}"]'.format(database.replace('"', '\\"'))
+    if if_later_than:
+        return '.show database {0} schema if_later_than "{1}" as json'.format(database, if_later_than)
+    return '.show database {0} schema as json'.format(database)
+
+
+def _columns(entity):
+    return [[column['Name'], column['CslType']] for column in entity.get('OrderedColumns', [])]
+
+
+def parse_schema(database_schema):
+    """
+    Convert the output of `schema_command` to
+    `{'tables': {name: [[column, kusto type], ...]}, 'views': {...}, 'version': 'v<major>.<minor>'}`,
+    the version is None when there is no schema, e.g. unchanged since `if_later_than`.
+    """
+    if isinstance(database_schema, str):
+        database_schema = json.loads(database_schema)
+
+    schema = {'tables': {}, 'views': {}, 'version': None}
+    for database in database_schema.get('Databases', {}).values():
+        for name, table in (database.get('Tables') or {}).items():
+            schema['tables'][name] = _columns(table)
+        for name, view in (database.get('MaterializedViews') or {}).items():
+            schema['views'][name] = _columns(view)
+        schema['version'] = 'v{0}.{1}'.format(database.get('MajorVersion'), database.get('MinorVersion'))
+    return schema
+
+
+class MetadataCache(object):
+    """
+    Database schemas of an engine, each one is kept for `ttl` seconds.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_METADATA_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}  # key -> (loaded at, schema)
+        self._loads = {}  # key -> lock held while its schema is loaded
+        self._lock = Lock()
+
+    def get(self, key, load):
+        """
+        Return the schema cached under `key`, calling `load()` for it when it
+        is missing or expired. Concurrent callers wait for a single load of
+        the same key, the loads of other keys go on.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry[0] < self.ttl:
+            return entry[1]
+
+        with self._lock:
+            key_lock = self._loads.setdefault(key, Lock())
+
+        with key_lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] < self.ttl:
+                return entry[1]
+
+            schema = load()
+            self.set(key, schema)
+            return schema
+
+    def set(self, key, schema):
+        with self._lock:
+            self._entries[key] = (time.time(), schema)
+
+    def invalidate(self, key=None):
+        """Forget the schema cached under `key`, or all of them."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+class DiskMetadataCache(object):
+    """
+    Database schemas persisted as one json file per cluster and database in
+    the directory `path`, so new processes skip the reflection round trip.
+    A schema older than `ttl` seconds is still returned, flagged as stale.
+    """
+
+    def __init__(self, path: str, ttl: float = DEFAULT_METADATA_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+
+    def _file(self, cluster, database):
+        key = hashlib.sha1('{0}/{1}'.format(cluster, database).encode('utf8')).hexdigest()
+        return os.path.join(self.path, 'adx_db_schema_{0}.json'.format(key))
+
+    def _read(self, file_name):
+        try:
+            with open(file_name) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get('format') != DISK_CACHE_FORMAT:
+            return None
+        return entry
+
+    def get(self, cluster, database):
+        """
+        Return `(schema, fresh)`, or None when nothing usable is stored.
+        """
+        entry = self._read(self._file(cluster, database))
+        if entry is None or entry.get('cluster') != cluster or entry.get('database') != database:
+            return None
+        return entry['schema'], time.time() - entry['fetched_at'] < self.ttl
+
+    def set(self, cluster, database, schema):
+        entry = {
+            'format': DISK_CACHE_FORMAT,
+            'cluster': cluster,
+            'database': database,
+            'version': schema.get('version'),
+            'fetched_at': time.time(),
+            'schema': schema,
+        }
+        os.makedirs(self.path, exist_ok=True)
+        atomic_write(self._file(cluster, database), json.dumps(entry))
+
+    def invalidate(self, database=None):
+        """Remove the stored schema of `database` (of any cluster), or all of them."""
+        if not os.path.isdir(self.path):
+            return
+
+        for name in os.listdir(self.path):
+            if not (name.startswith('adx_db_schema_') and name.endswith('.json')):
+                continue
+            file_name = os.path.join(self.path, name)
+            if database is not None:
+                entry = self._read(file_name)
+                if entry is not None and entry.get('database') != database:
+                    continue
+            try:
+                os.remove(file_name)
+            except OSError:
+                pass  # removed by another process
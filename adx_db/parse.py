@@ -1,5 +1,7 @@
 
+import ast
 import json
+import re
 from threading import Lock
 from collections import Mapping
 
@@ -11,13 +13,85 @@ from adx_db.sql_parser import SQLParser
 
 parseLocker = Lock()  # ENSURE ONLY ONE PARSING AT A TIME
 
+# `IN (...)` lists of at least this many literals skip the grammar, see `_extract_literal_lists`
+LITERAL_LIST_MIN_SIZE = 2
+
+_STRING = r"'(?:''|\\.|[^'])*'"
+_NUMBER = r"[+-]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?"
+_LITERAL = r"{0}|{1}".format(_STRING, _NUMBER)
+LITERAL_LIST = re.compile(
+    # quoted strings and identifiers come first, so an IN inside them is skipped
+    r"{0}|\"(?:\"\"|\\.|[^\"])*\"|`(?:``|[^`])*`"
+    r"|(?P<in>\bIN\s*)\(\s*(?P<values>(?:{1})(?:\s*,\s*(?:{1}))*)\s*\)".format(_STRING, _LITERAL),
+    re.IGNORECASE
+)
+LITERAL = re.compile(_LITERAL)
+INTEGER = re.compile(r"[+-]?\d+$")
+PLACEHOLDER = "__adx_db_literal_list_{0}__"
+
+
+def _literal_value(token):
+    if token.startswith("'"):
+        value = token[1:-1]
+        if "'" in value or "\\" in value:
+            # same unescaping as the grammar's string literals
+            value = ast.literal_eval("'" + value.replace("''", "\\'") + "'")
+        return value
+    if INTEGER.match(token):
+        return int(token)
+    return float(token)
+
+
+def _extract_literal_lists(sql):
+    """
+    Replace the long `IN (...)` lists of literals by placeholder identifiers.
+
+    The infixNotation grammar is very slow on long lists (filter boxes
+    generate thousands of values), so they are tokenised here with a regex
+    and put back by `_restore_literal_lists` in the same shape the grammar
+    produces: a list of numbers, else `{'literal': [...]}`.
+
+    :return: the sql to parse, and the values of each placeholder
+    """
+    lists = {}
+
+    def replace(match):
+        if match.group('in') is None:
+            return match.group(0)
+
+        values = [_literal_value(token) for token in LITERAL.findall(match.group('values'))]
+        if len(values) < LITERAL_LIST_MIN_SIZE:
+            return match.group(0)
+
+        name = PLACEHOLDER.format(len(lists))
+        if all(isinstance(v, number_types) for v in values):
+            lists[name] = values
+        else:
+            lists[name] = {"literal": values}
+        return match.group('in') + name
+
+    return LITERAL_LIST.sub(replace, sql), lists
+
+
+def _restore_literal_lists(result, lists):
+    if isinstance(result, text):
+        return lists.get(result, result)
+    elif isinstance(result, list):
+        return [_restore_literal_lists(r, lists) for r in result]
+    elif isinstance(result, Mapping):
+        return {k: _restore_literal_lists(v, lists) for k, v in result.items()}
+    return result
+
 
 def parse(sql):
     with parseLocker:
         try:
             all_exceptions.clear()
             sql = sql.rstrip().rstrip(";")
+            sql, lists = _extract_literal_lists(sql)
             parse_result = SQLParser.parseString(sql, parseAll=True)
+            if lists:
+                return _restore_literal_lists(_scrub(parse_result), lists)
             return _scrub(parse_result)
         except Exception as e:
             if isinstance(e, ParseException) and e.msg == "Expected end of text":
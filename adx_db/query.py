@@ -1,20 +1,123 @@
 
 import logging
+import re
+import time
+from functools import lru_cache
+from threading import Lock
 
 import pyparsing
 from sqlalchemy import String
-from azure.kusto.data import KustoClient, KustoConnectionStringBuilder
+from azure.kusto.data import ClientRequestProperties, KustoClient, KustoConnectionStringBuilder
 
 from adx_db.parse import parse as parse_sql
+from adx_db.admission import INTERACTIVE, AdmissionControl
+from adx_db.budget import ResultBudget
+from adx_db.circuit_breaker import CircuitBreakers
 from adx_db.convert import convert_rows
-from adx_db.exceptions import InterfaceError, ProgrammingError
-from adx_db.translator import translate, preprocess
+from adx_db.execution import DEFAULT_RETRY_POLICY, Cancellation, Execution, RetryPolicy, is_transient, wait
+from adx_db.exceptions import InterfaceError, NotSupportedError, OperationalError, ProgrammingError
+from adx_db.formatting import ROW_NUMBER
+from adx_db.instrumentation import emit, metrics, query_log
+from adx_db.result_cache import DiskResultCache, ResultCache, dump_payload, estimate_size, result_ttl
+from adx_db.single_flight import SingleFlight
+from adx_db.statistics import format_timespan, query_stats
+from adx_db.translator import cap_rows, translate, preprocess, paginate
 from adx_db.utils import format_moz_error
 from adx_db.column_type import column_type_dict
 
 
 logger = logging.getLogger(__name__)
 
+# the cheapest round trip to a cluster: no table is read, a single value is returned
+PING_QUERY = 'print 1'
+
+# seconds a ping waits for the cluster before it is considered unhealthy
+PING_TIMEOUT = 5
+
+# number of sql statements whose kql is kept by `translate_query`
+TRANSLATION_CACHE_SIZE = 1024
+
+# characters of the longest statement kept by `translate_query`: the values of
+# the parameters are part of a statement, a long IN list would otherwise keep
+# megabytes of sql and kql per statement in the cache
+TRANSLATION_CACHE_MAX_QUERY_SIZE = 8192
+
+# clients by cluster and credentials, a client keeps its http session and its aad token
+_clients = {}
+_clients_lock = Lock()
+
+# results of the queries executed with a `cache_ttl`, shared by all connections
+result_cache = ResultCache()
+
+# disk tiers of the result cache by directory, see `_disk_result_cache`
+_disk_caches = {}
+_disk_caches_lock = Lock()
+
+# names bound by the let statements of a kql query
+LET_NAME = re.compile(r'(?:^|;)\s*let\s+(\w+)\s*=')
+
+# requests to an unhealthy cluster are rejected at once, see `send`
+circuit_breakers = CircuitBreakers()
+
+# concurrency limits of the requests, none by default, e.g.
+# `admission_control.configure(cluster_limit=16, database_limit=8, queue_timeout=30)`
+admission_control = AdmissionControl()
+
+# queries being executed, see `execute`
+in_flight_queries = SingleFlight()
+
+
+def _boolean(value):
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def _consistency(value):
+    value = value.lower()
+    return value if value.endswith('consistency') else value + 'consistency'
+
+
+# request properties which can be set on a connection, also through the
+# engine url, and on an execution: name of the kusto option and conversion,
+# timespans are seconds, as a number or a string of the url, or a timedelta
+REQUEST_PROPERTIES = {
+    # max age of a result served from the results cache of the cluster
+    'results_cache_max_age': ('query_results_cache_max_age', format_timespan),
+    'server_timeout': (ClientRequestProperties.request_timeout_option_name, format_timespan),
+    'truncation_max_records': ('truncationmaxrecords', int),
+    'truncation_max_size': ('truncationmaxsize', int),
+    'no_truncation': ('notruncation', _boolean),
+    # report the errors of a truncated result in its QueryCompletionInformation rather than in its rows
+    'defer_partial_query_failures': (ClientRequestProperties.results_defer_partial_query_failures_option_name,
+                                     _boolean),
+    # `strong` or `weak`, weak consistency queries may be served by any node of the cluster
+    'query_consistency': ('queryconsistency', _consistency),
+}
+
+
+def build_request_properties(options: dict = None):
+    """
+    Return the ClientRequestProperties of options named as in
+    `REQUEST_PROPERTIES`, or None when there is no option.
+    """
+    if not options:
+        return None
+
+    properties = ClientRequestProperties()
+    for name, value in options.items():
+        if name not in REQUEST_PROPERTIES:
+            raise ProgrammingError('Unknown request property `{0}`, expected one of: {1}'.format(
+                name, ', '.join(sorted(REQUEST_PROPERTIES))))
+        if value is None:
+            continue
+        option, convert = REQUEST_PROPERTIES[name]
+        try:
+            properties.set_option(option, convert(value))
+        except (TypeError, ValueError):
+            raise ProgrammingError('Invalid value for request property `{0}`: {1!r}'.format(name, value))
+    return properties
+
 
 # def get_column_map(url, credentials=None):
 #     query = 'SELECT * LIMIT 0'
@@ -23,32 +126,150 @@ logger = logging.getLogger(__name__)
 #         sorted((col['label'], col['id']) for col in result['table']['cols']))
 
 
-def run_query(host, port, path, scheme, user, password, query):
-    headers = {
-        "X-Api-Key": password,
-        "Content-Type": "application/json; charset=utf-8"
-    }
+def get_client(host_url, user, password, authority_id, unauthenticated=False):
+    """
+    Return the client of a cluster and credentials, created once per process
+    so its connections and token are reused by the following queries.
+    With `unauthenticated`, the requests are sent without credentials, e.g.
+    to a local emulator or `tests/fake_kusto.py`.
+    """
+    key = (host_url, user, password, authority_id, unauthenticated)
+    client = _clients.get(key)
+    if client is not None:
+        return client
 
-    host_url = "{}://{}".format(scheme, host)
-    print("host_url: {} port: {} path: {} scheme: {} user: {} password: {}".format(host_url, port, path, scheme,
-                                                                               user, password))
-    print("query:", query)
-    authority_id, db = path.split('/')
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            if unauthenticated:
+                kcsb = KustoConnectionStringBuilder(host_url)
+            else:
+                kcsb = KustoConnectionStringBuilder.with_aad_application_key_authentication(host_url, user, password,
+                                                                                            authority_id)
+            client = _clients[key] = KustoClient(kcsb)
+        return client
 
-    print("authority_id: {} db: {}".format(authority_id, db))
 
-    kcsb = KustoConnectionStringBuilder.with_aad_application_key_authentication(host_url, user, password,
-                                                                                authority_id)
+def run_query(host, port, path, scheme, user, password, query, properties: ClientRequestProperties = None,
+              timeout: float = None, cancellation: Cancellation = None,
+              retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY, priority: str = INTERACTIVE, stats: dict = None,
+              unauthenticated: bool = False):
+    host_url = "{}://{}".format(scheme, host)
+    authority_id, db = path.split('/')
+    # arguments are only formatted when debug logging is enabled, the credentials never are
+    logger.debug('Query on %s/%s as %s: %s', host_url, db, user, query)
 
-    client = KustoClient(kcsb)
+    client = get_client(host_url, user, password, authority_id, unauthenticated)
 
-    response = client.execute(db, query)
+    response = send(host_url, client, db, query, properties, timeout, cancellation, retry_policy, priority, stats)
     rows = response.primary_results[0].raw_rows
     columns = response.primary_results[0].raw_columns
 
     return rows, columns
 
 
+def _is_cluster_failure(error: OperationalError, cancellation: Cancellation = None):
+    # a query given up because its callers timed out is a failure of a slow cluster
+    if cancellation is not None and cancellation.cancelled and not cancellation.timed_out:
+        return None
+    # timeouts have no cause, other failures without a transient cause are answers of the cluster, e.g. a syntax error
+    return error.__cause__ is None or is_transient(error.__cause__)
+
+
+def send(host_url, client, db, query, properties=None, timeout=None, cancellation=None, retry_policy=None,
+         priority=INTERACTIVE, stats: dict = None):
+    """
+    Return the response to a request, through the circuit breaker of the
+    cluster and the admission control, see `adx_db.execution.Execution.run`.
+
+    The statistics of the query are published as a `query_stats` event, and
+    added to `stats` when it is given. A sample of the requests is logged by
+    `adx_db.instrumentation.query_log`.
+    """
+    breaker = circuit_breakers.get(host_url)
+    if breaker is not None:
+        breaker.allow()
+
+    start = time.monotonic()
+    try:
+        limiters = admission_control.admit(host_url, db, priority, timeout, cancellation)
+    except BaseException:
+        if breaker is not None:
+            breaker.record(None)
+        raise
+    if timeout and limiters:
+        # the time spent in the queue is part of the timeout
+        timeout = max(0.001, timeout - (time.monotonic() - start))
+
+    execution = Execution(client, db, query, properties)
+    sampled = query_log.sampled()
+    try:
+        response = execution.run(timeout, cancellation, retry_policy)
+    except OperationalError as e:
+        if breaker is not None:
+            breaker.record(_is_cluster_failure(e, cancellation))
+        if sampled:
+            query_log.record(query, time.monotonic() - start, e, cluster=host_url, database=db,
+                             client_request_id=execution.client_request_id, retries=execution.retries)
+        raise
+    except BaseException:
+        if breaker is not None:
+            breaker.record(None)
+        raise
+
+    finally:
+        admission_control.release(limiters)
+
+    if breaker is not None:
+        breaker.record(False)
+
+    statistics = query_stats(response)
+    statistics['retries'] = execution.retries
+    emit('query_stats', cluster=host_url, database=db, client_request_id=execution.client_request_id,
+         query=query, stats=statistics)
+    if stats is not None:
+        stats.update(statistics)
+    if sampled:
+        query_log.record(query, time.monotonic() - start, cluster=host_url, database=db,
+                         client_request_id=execution.client_request_id, retries=execution.retries,
+                         rows=statistics.get('result_rows'), cpu_time=statistics.get('cpu_time'))
+    return response
+
+
+def run_batch(host, port, path, scheme, user, password, queries: list, properties: ClientRequestProperties = None,
+              timeout: float = None, cancellation: Cancellation = None,
+              retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY, priority: str = INTERACTIVE, stats: dict = None,
+              unauthenticated: bool = False):
+    """
+    Run several kql queries in a single request, as the statements of a
+    batch, and return the `(rows, columns)` of each one.
+    """
+    host_url = "{}://{}".format(scheme, host)
+    authority_id, db = path.split('/')
+    client = get_client(host_url, user, password, authority_id, unauthenticated)
+
+    response = send(host_url, client, db, ';\n'.join(queries), properties, timeout, cancellation, retry_policy,
+                    priority, stats)
+    tables = response.primary_results
+    if len(tables) != len(queries):
+        raise OperationalError('Expected {0} results from the batch, got {1}'.format(len(queries), len(tables)))
+    return [(table.raw_rows, table.raw_columns) for table in tables]
+
+
+def ping(host, port, path, scheme, user, password, timeout: float = PING_TIMEOUT, unauthenticated: bool = False):
+    """
+    Run `PING_QUERY` with the pooled client of the cluster and return its
+    latency in seconds, raise OperationalError when the cluster fails or does
+    not answer within `timeout` seconds.
+    """
+    authority_id, db = path.split('/')
+    client = get_client("{}://{}".format(scheme, host), user, password, authority_id, unauthenticated)
+
+    start = time.perf_counter()
+    Execution(client, db, PING_QUERY).run(timeout)
+    return time.perf_counter() - start
+
+
 def get_description_from_payload(payload):
     """
     Return description from a single row.
@@ -67,18 +288,38 @@ def get_description_from_payload(payload):
     ]
 
 
-def execute(query,
-            headers: int = 0,
-            host: str = "",
-            port: int = 80,
-            path: str = "/v1/apps",
-            scheme: str = "https",
-            user: str = "",
-            password: str = ""):
-    print('query0', query)
-    query = preprocess(query)
+def translate_query(query, page: tuple = None, max_rows: int = None):
+    """
+    Return the kql sent to kusto for a query, sql select statements are
+    translated and anything else is considered kql already.
+
+    The kql of the last `TRANSLATION_CACHE_SIZE` statements shorter than
+    `TRANSLATION_CACHE_MAX_QUERY_SIZE` is cached, so a statement executed
+    again, e.g. compiled once by the sqlalchemy statement cache and executed
+    many times, is not parsed again.
+
+    :param page: optional `(offset, limit, order_by)`, only that page of a select
+                 statement is queried, see `adx_db.translator.paginate`
+    :param max_rows: limit of the select statements without a LIMIT, see
+                     `adx_db.translator.cap_rows`
+    """
+    if len(query) > TRANSLATION_CACHE_MAX_QUERY_SIZE:
+        return _translate_query(query, page, max_rows)
+    if page is not None and page[2] is not None:
+        offset, limit, order_by = page
+        if not all(isinstance(o, str) for o in order_by):
+            # sort items are dicts, which cannot be part of the cache key
+            return _translate_query(query, page, max_rows)
+        page = (offset, limit, tuple(order_by))
+    return _cached_translate_query(query, page, max_rows)
+
+
+def clear_translation_cache():
+    _cached_translate_query.cache_clear()
+
 
-    print('Original query: {}'.format(query))
+def _translate_query(query, page: tuple = None, max_rows: int = None, rewrites: list = None):
+    query = preprocess(query)
 
     if query.lower().startswith('select'):
         try:
@@ -86,13 +327,68 @@ def execute(query,
         except pyparsing.ParseException as e:
             raise ProgrammingError(format_moz_error(query, e))
 
-        translated_query = translate(parsed_query)
-        print('Translated query: {}'.format(translated_query))
+        if page is not None:
+            parsed_query = paginate(parsed_query, *page)
+        if max_rows is not None:
+            capped = cap_rows(parsed_query, max_rows)
+            if rewrites is not None and capped != parsed_query:
+                rewrites.append(cap_rows.__name__)
+            parsed_query = capped
+
+        translated_query = translate(parsed_query, rewrites)
+        logger.debug('Translated %s to %s', query, translated_query)
+    elif page is not None:
+        raise NotSupportedError('Paging is only supported for SQL select statements')
     else:
         translated_query = query
 
-    rows, columns = run_query(host, port, path, scheme, user, password, translated_query)
+    return translated_query
+
+
+_cached_translate_query = lru_cache(maxsize=TRANSLATION_CACHE_SIZE)(_translate_query)
+
+
+def explain(query,
+            host: str = "",
+            port: int = 80,
+            path: str = "/v1/apps",
+            scheme: str = "https",
+            user: str = "",
+            password: str = "",
+            page: tuple = None,
+            plan: bool = False,
+            budget: ResultBudget = None,
+            options: dict = None,
+            timeout: float = None,
+            cancellation: Cancellation = None,
+            priority: str = INTERACTIVE,
+            unauthenticated: bool = False):
+    """
+    Return what `execute` would send for a query, without executing it: a
+    dict with the preprocessed query (`sql`), its kql (`kql`) and the names
+    of the rewrite passes which changed it (`rewrites`).
+
+    With `plan`, the query plan of the cluster is requested as well with
+    `.show queryplan`, which plans the query but does not run it, and its
+    rows are returned as dicts (`plan`).
+    """
+    rewrites = []
+    kql = _translate_query(query, page, budget and budget.row_cap, rewrites)
+    explanation = {'sql': preprocess(query), 'kql': kql, 'rewrites': rewrites, 'plan': None}
+    if not plan:
+        return explanation
 
+    if kql.lstrip().startswith('.'):
+        raise NotSupportedError('Control commands have no query plan')
+    rows, columns = run_query(host, port, path, scheme, user, password, '.show queryplan <| {0}'.format(kql),
+                              build_request_properties(options), timeout, cancellation, priority=priority,
+                              unauthenticated=unauthenticated)
+    names = [column['ColumnName'] for column in columns]
+    explanation['plan'] = [dict(zip(names, row)) for row in rows]
+    return explanation
+
+
+def get_results(rows, columns):
     cols = [each["ColumnName"] for each in columns]
 
     description = get_description_from_payload(columns)
@@ -100,3 +396,284 @@ def execute(query,
     results = convert_rows(cols, rows)
 
     return results, description
+
+
+def execute(query,
+            headers: int = 0,
+            host: str = "",
+            port: int = 80,
+            path: str = "/v1/apps",
+            scheme: str = "https",
+            user: str = "",
+            password: str = "",
+            page: tuple = None,
+            cache_ttl: float = None,
+            cache_path: str = None,
+            options: dict = None,
+            timeout: float = None,
+            cancellation: Cancellation = None,
+            retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+            priority: str = INTERACTIVE,
+            budget: ResultBudget = None,
+            stats: dict = None,
+            unauthenticated: bool = False):
+    """
+    Return the rows and the description of the result of a query, the rows
+    are a tuple which may be shared by several callers.
+
+    Concurrent executions of the same query by the same user on the same
+    cluster and database, with the same options, are coalesced: the query
+    runs once and they all wait for its result, each one with its own
+    timeout and cancellation.
+
+    With `cache_ttl`, a result fetched less than `cache_ttl` seconds ago
+    (`RELATIVE_TIME_TTL` for queries using `ago()` or `now()`) is returned
+    without running the query again, from `result_cache` or else from files
+    in `cache_path`.
+
+    :param options: request properties of the query, see `REQUEST_PROPERTIES`
+    :param timeout: seconds after which OperationalError is raised and the
+                    query is cancelled, unless other callers wait for it
+    :param cancellation: cancels the query from another thread, unless other
+                         callers wait for it, OperationalError is then raised
+    :param retry_policy: retries of the query on transient failures, None for no retry
+    :param priority: `interactive` or `scheduled`, see `adx_db.admission`
+    :param budget: rows and bytes read at most, see `adx_db.budget`
+    :param stats: filled with the statistics of the query, see `adx_db.statistics`,
+                  whether the result comes from the cache or another thread and
+                  whether it was truncated to the budget
+    :param unauthenticated: send the query without credentials, see `get_client`
+    """
+    translated_query = translate_query(query, page, budget and budget.row_cap)
+    if stats is None:
+        stats = {}
+
+    # options such as truncation limits change the result, and so does the budget
+    key = (host, path.split('/')[-1], user, translated_query, repr(sorted((options or {}).items())), repr(budget))
+
+    if cache_ttl:
+        cached = result_cache.get(key, result_ttl(translated_query, cache_ttl))
+        if cached is not None:
+            # truncated results are not kept in memory
+            stats.update(result_cache_hit=True, coalesced=False, truncated=False)
+            return cached
+
+    def fetch(timeout, cancellation):
+        return _fetch(key, translated_query, host, port, path, scheme, user, password, options, cache_ttl, cache_path,
+                      timeout, cancellation, retry_policy, priority, budget, unauthenticated)
+
+    if translated_query.lstrip().startswith('.'):
+        # control commands may change the database, each one is executed
+        (results, description, query_stats), shared = fetch(timeout, cancellation), False
+    else:
+        # the query is shared by the concurrent callers: it runs without the timeout and the
+        # cancellation of any of them, each one stops waiting on its own, and it is cancelled
+        # once none waits for it anymore
+        (results, description, query_stats), shared = in_flight_queries.do(
+            key, lambda shared_cancellation: fetch(None, shared_cancellation),
+            lambda event: wait(event, timeout, cancellation))
+        if shared:
+            metrics.increment('queries_coalesced')
+
+    stats.update(query_stats, coalesced=shared)
+    return results, description
+
+
+def _fetch(key, query, host, port, path, scheme, user, password, options, cache_ttl, cache_path,
+           timeout=None, cancellation=None, retry_policy=DEFAULT_RETRY_POLICY, priority=INTERACTIVE, budget=None,
+           unauthenticated=False):
+    """Return the rows, description and statistics of a query, see `execute`."""
+    if budget is not None:
+        options = dict(budget.request_options(), **(options or {}))
+    properties = build_request_properties(options)
+    stats = {'result_cache_hit': False, 'truncated': False}
+
+    if not cache_ttl:
+        rows, columns = run_query(host, port, path, scheme, user, password, query, properties, timeout, cancellation,
+                                  retry_policy, priority, stats, unauthenticated)
+        if budget is not None:
+            rows, stats['truncated'] = budget.apply(rows, stats.get('partial_failure', False))
+        results, description = get_results(rows, columns)
+        return tuple(results), description, stats
+
+    ttl = result_ttl(query, cache_ttl)
+    disk_cache = _disk_result_cache(cache_path) if cache_path else None
+    stored = disk_cache.get(key, ttl) if disk_cache else None
+    if stored is not None:
+        rows, columns, stored_at, size = stored
+        stats['result_cache_hit'] = True
+    else:
+        rows, columns = run_query(host, port, path, scheme, user, password, query, properties, timeout, cancellation,
+                                  retry_policy, priority, stats, unauthenticated)
+        stored_at = None
+        # a result truncated by the cluster is not cached
+        if disk_cache and not stats.get('partial_failure'):
+            payload = dump_payload(rows, columns)
+            size = len(payload)
+            disk_cache.set(key, payload)
+        else:
+            size = estimate_size(rows, columns)
+
+    # the raw result is cached, the budget applies to each read of it
+    if budget is not None:
+        rows, stats['truncated'] = budget.apply(rows, stats.get('partial_failure', False))
+    results, description = get_results(rows, columns)
+    results = tuple(results)
+    if not stats['truncated']:
+        result_cache.set(key, results, description, size, stored_at)
+    return results, description, stats
+
+
+def _disk_result_cache(path):
+    """The disk tier of the result cache in `path`, one per directory so it keeps the size of its files."""
+    with _disk_caches_lock:
+        if path not in _disk_caches:
+            _disk_caches[path] = DiskResultCache(path, result_cache.max_bytes)
+        return _disk_caches[path]
+
+
+def batches(queries: list):
+    """
+    Split kql queries into batches, the queries of a batch do not bind the
+    same names in their let statements.
+    """
+    batch, names = [], set()
+    for index, kql in enumerate(queries):
+        bound = set(LET_NAME.findall(kql))
+        if batch and names & bound:
+            yield batch
+            batch, names = [], set()
+        batch.append(index)
+        names |= bound
+    if batch:
+        yield batch
+
+
+def execute_batch(queries: list,
+                  host: str = "",
+                  port: int = 80,
+                  path: str = "/v1/apps",
+                  scheme: str = "https",
+                  user: str = "",
+                  password: str = "",
+                  options: dict = None,
+                  timeout: float = None,
+                  cancellation: Cancellation = None,
+                  retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+                  priority: str = INTERACTIVE,
+                  budget: ResultBudget = None,
+                  unauthenticated: bool = False):
+    """
+    Return the `(rows, description, stats)` of each query of `queries`, run
+    together in as few requests as possible instead of one request per query.
+    The statistics are the ones of the request of the query, `timeout` and
+    `cancellation` apply to each request, see `execute`.
+    """
+    translated_queries = [translate_query(query, max_rows=budget and budget.row_cap) for query in queries]
+    if any(kql.lstrip().startswith('.') for kql in translated_queries):
+        raise NotSupportedError('Control commands cannot be executed in a batch')
+
+    if budget is not None:
+        options = dict(budget.request_options(), **(options or {}))
+    properties = build_request_properties(options)
+    results = [None] * len(queries)
+    for batch in batches(translated_queries):
+        stats = {}
+        tables = run_batch(host, port, path, scheme, user, password,
+                           [translated_queries[i] for i in batch], properties, timeout, cancellation,
+                           retry_policy, priority, stats, unauthenticated)
+        metrics.increment('batched_queries', len(batch))
+        for index, (rows, columns) in zip(batch, tables):
+            truncated = False
+            if budget is not None:
+                rows, truncated = budget.apply(rows, stats.get('partial_failure', False))
+            rows, description = get_results(rows, columns)
+            results[index] = tuple(rows), description, dict(stats, truncated=truncated)
+    return results
+
+
+def store_result(name: str,
+                 ttl: str,
+                 query,
+                 host: str = "",
+                 port: int = 80,
+                 path: str = "/v1/apps",
+                 scheme: str = "https",
+                 user: str = "",
+                 password: str = "",
+                 options: dict = None,
+                 timeout: float = None,
+                 cancellation: Cancellation = None,
+                 priority: str = INTERACTIVE,
+                 stats: dict = None,
+                 budget: ResultBudget = None,
+                 unauthenticated: bool = False):
+    """
+    Execute a query and keep its result on the server as the stored query
+    result `name` for `ttl` (a kusto timespan such as `1h`), its rows are
+    numbered so `fetch_stored_result` can read them page by page. `stats`
+    is filled with the statistics of the query. The query is limited and
+    its result truncated to `budget` as by `execute`, the reader applies the
+    budget to the pages it reads, see `ResultBudget.apply`.
+    """
+    command = '.set stored_query_result {name} with (previewCount = 0, expiresAfter = {ttl}) <| ' \
+              '{query} | serialize {row_number}=row_number()'.format(
+                  name=name, ttl=ttl, query=translate_query(query, max_rows=budget and budget.row_cap),
+                  row_number=ROW_NUMBER)
+
+    if budget is not None:
+        options = dict(budget.request_options(), **(options or {}))
+
+    run_query(host, port, path, scheme, user, password, command, build_request_properties(options),
+              timeout, cancellation, priority=priority, stats=stats, unauthenticated=unauthenticated)
+
+
+def fetch_stored_result(name: str,
+                        start: int,
+                        size: int = None,
+                        host: str = "",
+                        port: int = 80,
+                        path: str = "/v1/apps",
+                        scheme: str = "https",
+                        user: str = "",
+                        password: str = "",
+                        options: dict = None,
+                        timeout: float = None,
+                        cancellation: Cancellation = None,
+                        retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+                        priority: str = INTERACTIVE,
+                        unauthenticated: bool = False):
+    """
+    Return `size` rows (all remaining rows when None) following the first
+    `start` rows of a stored query result, and their description. Reading
+    it is retried with `retry_policy`, see `run_query`.
+    """
+    window = '{0} > {1}'.format(ROW_NUMBER, start)
+    if size is not None:
+        window += ' and {0} <= {1}'.format(ROW_NUMBER, start + size)
+
+    query = "stored_query_result('{name}') | where {window} | order by {row_number} asc | project-away {row_number}".format(
+        name=name, window=window, row_number=ROW_NUMBER)
+
+    rows, columns = run_query(host, port, path, scheme, user, password, query, build_request_properties(options),
+                              timeout, cancellation, retry_policy=retry_policy, priority=priority,
+                              unauthenticated=unauthenticated)
+
+    return get_results(rows, columns)
+
+
+def drop_stored_result(name: str,
+                       host: str = "",
+                       port: int = 80,
+                       path: str = "/v1/apps",
+                       scheme: str = "https",
+                       user: str = "",
+                       password: str = "",
+                       options: dict = None,
+                       timeout: float = None,
+                       cancellation: Cancellation = None,
+                       priority: str = INTERACTIVE,
+                       unauthenticated: bool = False):
+    run_query(host, port, path, scheme, user, password, '.drop stored_query_result {0}'.format(name),
+              build_request_properties(options), timeout, cancellation, priority=priority,
+              unauthenticated=unauthenticated)
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from adx_db.utils import atomic_write
+
+# bytes of results kept by a cache, measured as the size of their json payload
+DEFAULT_RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# seconds the result of a query relative to the current time, e.g. using
+# `ago()` or `now()`, is served from the cache at most
+RELATIVE_TIME_TTL = 10
+
+# layout of the files written by `DiskResultCache`, files of another layout are ignored
+DISK_CACHE_FORMAT = 1
+
+# rows serialized by `estimate_size` and `estimate_rows_size` for the size of more rows
+SIZE_SAMPLE_ROWS = 100
+
+# seconds between two listings of the directory of a `DiskResultCache` while
+# the size of its files is known to be below its max_bytes, other processes
+# write files too
+DISK_EVICTION_INTERVAL = 60
+
+# fraction of its max_bytes a `DiskResultCache` beyond it is reduced to, so
+# that the following writes do not list its directory again
+DISK_EVICTION_TARGET = 0.75
+
+RELATIVE_TIME = re.compile(r'\b(ago|now)\s*\(', re.IGNORECASE)
+
+
+def result_ttl(kql: str, ttl: float):
+    """
+    Return the seconds the result of `kql` can be served from the cache,
+    `ttl` unless the result depends on the current time.
+    """
+    if RELATIVE_TIME.search(kql):
+        return min(ttl, RELATIVE_TIME_TTL)
+    return ttl
+
+
+def dump_payload(rows, columns):
+    """Serialize raw rows and columns, the size of the result is the length of this payload."""
+    return json.dumps({'columns': columns, 'rows': rows}, default=str)
+
+
+def _sample(rows):
+    """`SIZE_SAMPLE_ROWS` rows evenly spread over `rows`, or all of them."""
+    if len(rows) <= SIZE_SAMPLE_ROWS:
+        return rows
+    step = len(rows) / SIZE_SAMPLE_ROWS
+    return [rows[int(i * step)] for i in range(SIZE_SAMPLE_ROWS)]
+
+
+def estimate_rows_size(rows):
+    """Estimate of the length of the json of rows, computed from a sample of them."""
+    sample = _sample(rows)
+    size = len(json.dumps(sample, default=str))
+    return size if sample is rows else size * len(rows) // len(sample)
+
+
+def estimate_size(rows, columns):
+    """
+    Estimate of the size of a result, the length of its `dump_payload`
+    computed from a sample of its rows so that it is cheap for a large one.
+    """
+    sample = _sample(rows)
+    if sample is rows:
+        return len(dump_payload(rows, columns))
+    empty = len(dump_payload([], columns))
+    return empty + (len(dump_payload(sample, columns)) - empty) * len(rows) // len(sample)
+
+
+class ResultCache(object):
+    """
+    Query results kept in memory, the least recently used ones are evicted
+    beyond `max_bytes`. The results are tuples of rows shared by all the
+    cursors reading them, they must not be modified.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_RESULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (stored at, size, results, description)
+        self._lock = Lock()
+
+    def get(self, key, ttl: float):
+        """
+        Return `(results, description)` cached under `key` less than `ttl`
+        seconds ago, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            # an older entry is kept, connections with a longer ttl may still use it
+            if entry is None or time.time() - entry[0] >= ttl:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2], entry[3]
+
+    def set(self, key, results: tuple, description, size: int, stored_at: float = None):
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self._entries[key] = (stored_at or time.time(), size, results, description)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class DiskResultCache(object):
+    """
+    Raw query results persisted as one file per query in the directory
+    `path`, shared by processes. The oldest files are removed beyond
+    `max_bytes`.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_RESULT_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        # bytes of the files at the last listing of the directory plus the
+        # ones written since, None until the first listing
+        self._size = None
+        self._listed_at = 0.0
+        self._lock = Lock()
+
+    def _file(self, key):
+        digest = hashlib.sha1(json.dumps(list(key)).encode('utf8')).hexdigest()
+        return os.path.join(self.path, 'adx_db_result_{0}.json'.format(digest))
+
+    def get(self, key, ttl: float):
+        """
+        Return `(rows, columns, stored at, size)` stored under `key` less than
+        `ttl` seconds ago, or None.
+        """
+        try:
+            with open(self._file(key)) as f:
+                header = json.loads(f.readline())
+                if (not isinstance(header, dict) or header.get('format') != DISK_CACHE_FORMAT
+                        or header.get('key') != list(key) or time.time() - header['stored_at'] >= ttl):
+                    return None
+                payload = f.read()
+            result = json.loads(payload)
+        except (OSError, ValueError, KeyError):
+            return None
+        return result['rows'], result['columns'], header['stored_at'], len(payload)
+
+    def set(self, key, payload: str):
+        """Store the `dump_payload` of a result under `key`."""
+        if len(payload) > self.max_bytes:
+            return
+
+        header = json.dumps({'format': DISK_CACHE_FORMAT, 'key': list(key), 'stored_at': time.time()})
+        os.makedirs(self.path, exist_ok=True)
+
+        atomic_write(self._file(key), header + '\n', payload)
+
+        with self._lock:
+            if self._size is not None:
+                self._size += len(header) + 1 + len(payload)
+            if (self._size is None or self._size > self.max_bytes
+                    or time.time() - self._listed_at >= DISK_EVICTION_INTERVAL):
+                self._size = self._evict()
+                self._listed_at = time.time()
+
+    def _evict(self):
+        """Remove the oldest files beyond `max_bytes`, return the size of the remaining ones."""
+        files = []
+        for name in os.listdir(self.path):
+            if name.startswith('adx_db_result_') and name.endswith('.json'):
+                try:
+                    stat = os.stat(os.path.join(self.path, name))
+                except OSError:
+                    continue  # removed by another process
+                files.append((stat.st_mtime, stat.st_size, name))
+
+        size = sum(f[1] for f in files)
+        if size <= self.max_bytes:
+            return size
+        for _, file_size, name in sorted(files):
+            if size <= self.max_bytes * DISK_EVICTION_TARGET:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            size -= file_size
+        return size
+
+    def clear(self):
+        with self._lock:
+            self._size = None
+        if not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            if name.startswith('adx_db_result_') and name.endswith('.json'):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
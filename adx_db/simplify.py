@@ -0,0 +1,221 @@
+from mo_future import string_types
+
+# comparisons folded when both sides are constants of the same type
+COMPARISONS = {
+    'eq': lambda a, b: a == b,
+    'neq': lambda a, b: a != b,
+    'gt': lambda a, b: a > b,
+    'gte': lambda a, b: a >= b,
+    'lt': lambda a, b: a < b,
+    'lte': lambda a, b: a <= b,
+}
+
+# clauses holding one expression, dropped when they simplify to true
+FILTER_CLAUSES = ('where', 'having')
+
+# clauses holding a list of `{'value': expression}` items
+COLUMN_CLAUSES = ('select', 'groupby', 'orderby')
+
+
+def _is_number(json):
+    return isinstance(json, (int, float)) and not isinstance(json, bool)
+
+
+def _as_bool(json):
+    """
+    Return True or False for a boolean constant, None for anything else.
+    """
+    if isinstance(json, bool):
+        return json
+    if isinstance(json, string_types) and json.lower() in ('true', 'false'):
+        return json.lower() == 'true'
+    return None
+
+
+def _constant(json):
+    """
+    Return `(True, value)` for a number or a string literal, `(False, None)` otherwise.
+    """
+    if _is_number(json):
+        return True, json
+    if isinstance(json, dict) and list(json.keys()) == ['literal'] and isinstance(json['literal'], string_types):
+        return True, json['literal']
+    return False, None
+
+
+def _flatten(op, operands):
+    """
+    Collapse nested nodes of the same operator, `a and (b and c)` has the operands `a, b, c`.
+    """
+    flat = []
+    for operand in operands:
+        if isinstance(operand, dict) and list(operand.keys()) == [op]:
+            flat.extend(_flatten(op, operand[op]))
+        else:
+            flat.append(operand)
+    return flat
+
+
+def _dedupe(operands):
+    unique = []
+    for operand in operands:
+        if operand not in unique:
+            unique.append(operand)
+    return unique
+
+
+def _simplify_logical(op, operands):
+    # `true` absorbs an or and is neutral in an and, the other way round for `false`
+    absorbing = op == 'or'
+
+    kept = []
+    for operand in _dedupe(_flatten(op, operands)):
+        value = _as_bool(operand)
+        if value is None:
+            kept.append(operand)
+        elif value == absorbing:
+            return absorbing
+
+    if not kept:
+        return not absorbing
+    if len(kept) == 1:
+        return kept[0]
+    return {op: kept}
+
+
+def _simplify_arithmetic(op, operands):
+    if op in ('add', 'mul'):
+        operands = _flatten(op, operands)
+
+        numbers = [o for o in operands if _is_number(o)]
+        others = [o for o in operands if not _is_number(o)]
+        if len(numbers) < 2:
+            return {op: operands}
+
+        folded = numbers[0]
+        for number in numbers[1:]:
+            folded = folded + number if op == 'add' else folded * number
+        if not others:
+            return folded
+        return {op: others + [folded]}
+
+    if len(operands) != 2 or not all(_is_number(o) for o in operands):
+        return {op: operands}
+
+    a, b = operands
+    if op == 'sub':
+        return a - b
+    if b == 0:
+        return {op: operands}
+    if op == 'div':
+        if isinstance(a, float) or isinstance(b, float):
+            return a / b
+        # kusto truncates integer division towards zero, python floors it
+        if a % b == 0 or (a >= 0 and b > 0):
+            return a // b
+    elif op == 'mod':
+        if a >= 0 and b > 0:
+            return a % b
+    return {op: operands}
+
+
+def simplify_expression(json):
+    """
+    Fold constant sub-expressions of a parsed expression, e.g. `1 = 1 AND x = 'a'`
+    becomes `x = 'a'` and `NOT NOT a` becomes `a`, so kusto does not evaluate
+    them for every row.
+    """
+    if isinstance(json, list):
+        return [simplify_expression(v) for v in json]
+    if not isinstance(json, dict) or not json:
+        return json
+    if 'select' in json or 'from' in json or 'union' in json or 'union_all' in json:
+        return simplify(json)
+    if 'literal' in json:
+        return json
+    if len(json) > 1:
+        # not an operator, e.g. a `{'when': ..., 'then': ...}` of a case
+        return {k: simplify_expression(v) for k, v in json.items()}
+
+    op, value = list(json.items())[0]
+    if op in ('in', 'nin') and isinstance(value, list) and len(value) == 2:
+        # leave the (possibly long) list of values as it is
+        return {op: [simplify_expression(value[0]), value[1]]}
+    value = simplify_expression(value)
+
+    if op in ('and', 'or') and isinstance(value, list):
+        return _simplify_logical(op, value)
+
+    if op == 'not':
+        constant = _as_bool(value)
+        if constant is not None:
+            return not constant
+        if isinstance(value, dict) and list(value.keys()) == ['not']:
+            return value['not']
+        return {op: value}
+
+    if op == 'neg' and _is_number(value):
+        return -value
+
+    if op in ('add', 'mul', 'sub', 'div', 'mod') and isinstance(value, list):
+        return _simplify_arithmetic(op, value)
+
+    if op in COMPARISONS and isinstance(value, dict) and list(value.keys()) == ['literal']:
+        # the parser merges operands which are all literals, `'a' = 'b'` is `{'eq': {'literal': ['a', 'b']}}`
+        value = value['literal']
+        if isinstance(value, list) and len(value) == 2 and _is_number(value[0]) == _is_number(value[1]):
+            return COMPARISONS[op](*value)
+        return {op: {'literal': value}}
+
+    if op in COMPARISONS and isinstance(value, list) and len(value) == 2:
+        (left_constant, left), (right_constant, right) = _constant(value[0]), _constant(value[1])
+        if left_constant and right_constant and _is_number(left) == _is_number(right):
+            return COMPARISONS[op](left, right)
+
+    return {op: value}
+
+
+def simplify(json: dict):
+    """
+    Rewrite pass: simplify the expressions of a parsed query and of its
+    nested queries, and drop the filters left always true.
+    """
+    if not isinstance(json, dict):
+        return json
+
+    json = dict(json)
+    for key in ('union', 'union_all'):
+        if key in json:
+            json[key] = [simplify(branch) for branch in json[key]]
+
+    if 'with' in json:
+        with_ = json['with']
+        if isinstance(with_, list):
+            json['with'] = [dict(part, value=simplify(part['value'])) for part in with_]
+        else:
+            json['with'] = dict(with_, value=simplify(with_['value']))
+
+    from_ = json.get('from')
+    if isinstance(from_, dict):
+        if 'value' in from_:
+            json['from'] = dict(from_, value=simplify(from_['value']))
+        else:
+            json['from'] = simplify(from_)
+
+    for key in FILTER_CLAUSES:
+        if key in json:
+            json[key] = simplify_expression(json[key])
+            if _as_bool(json[key]) is True:
+                del json[key]
+
+    for key in COLUMN_CLAUSES:
+        columns = json.get(key)
+        if isinstance(columns, dict):
+            json[key] = dict(columns, value=simplify_expression(columns['value']))
+        elif isinstance(columns, list):
+            json[key] = [
+                dict(c, value=simplify_expression(c['value'])) if isinstance(c, dict) and 'value' in c else c
+                for c in columns
+            ]
+
+    return json
@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+
+from adx_db.execution import QUERY_THREADS, Cancellation, QueryTimeout
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = False
+        self.result = None
+        self.error = None
+        self.waiters = []  # events of the callers waiting for the call, set when it is done
+        # cancelled when no caller waits for the call anymore, as timed out when the last one timed out
+        self.cancellation = Cancellation()
+
+
+class SingleFlight(object):
+    """
+    Run a function once for the concurrent calls with the same key, the
+    callers wait for it and share its result, which must be immutable.
+    """
+
+    def __init__(self, max_workers: int = QUERY_THREADS):
+        self._calls = {}
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='adx_db-single-flight')
+
+    def do(self, key, function, wait=None):
+        """
+        Return `(function(cancellation), shared)`, `shared` is True when the
+        call was started by another caller. Its exception is raised in all the
+        callers.
+
+        The function runs on a thread of its own, so that each caller waits
+        for it with its own timeout and cancellation: when the last caller
+        stops waiting before it is done, `cancellation` is cancelled and the
+        following callers start a new call.
+
+        :param wait: called by the callers with an event set when the call is
+                     done, returns once the event is set and may raise to stop
+                     waiting, e.g. `adx_db.execution.wait`
+        """
+        waiter = Event()
+        with self._lock:
+            call = self._calls.get(key)
+            shared = call is not None
+            if not shared:
+                call = self._calls[key] = _Call()
+            call.waiters.append(waiter)
+        if not shared:
+            self._executor.submit(self._run, key, call, function)
+
+        try:
+            if wait is None:
+                waiter.wait()
+            else:
+                wait(waiter)
+        except BaseException as e:
+            self._leave(key, call, waiter, isinstance(e, QueryTimeout))
+            raise
+
+        if call.error is not None:
+            raise call.error
+        return call.result, shared
+
+    def _run(self, key, call, function):
+        try:
+            call.result = function(call.cancellation)
+        except BaseException as e:
+            call.error = e
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                call.done = True
+                waiters, call.waiters = call.waiters, []
+            for waiter in waiters:
+                waiter.set()
+
+    def _leave(self, key, call, waiter, timed_out):
+        with self._lock:
+            if call.done:
+                return
+            call.waiters.remove(waiter)
+            if call.waiters:
+                return
+            # no caller waits for the call anymore
+            del self._calls[key]
+        call.cancellation.cancel(timed_out)
@@ -197,7 +197,7 @@ def to_union_call(instring, tokensStart, retTokens):
         if any(o.lower().replace(" ", "_") != op for o in operators[1:]):
             raise Exception("Expecting all \"union all\" or all \"union\", not some combination")
 
-        if not tok.get('orderby') and not tok.get('limit'):
+        if not tok.get('orderby') and not tok.get('limit') and not tok.get('offset'):
             return {op: sources}
         else:
             output = {"from": {op: sources}}
@@ -206,6 +206,8 @@ def to_union_call(instring, tokensStart, retTokens):
         output["orderby"] = tok.get('orderby')
     if tok.get('limit'):
         output["limit"] = tok.get('limit')
+    if tok.get('offset'):
+        output["offset"] = tok.get('offset')
     return output
 
 
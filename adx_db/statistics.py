@@ -0,0 +1,106 @@
+import json
+import logging
+from datetime import timedelta
+
+from azure.kusto.data._models import WellKnownDataSet
+
+logger = logging.getLogger(__name__)
+
+# events of the query completion information below this level (critical,
+# error) are failures of the query, whose result is partial
+PARTIAL_FAILURE_LEVEL = 3
+
+
+def timespan_seconds(timespan):
+    """Seconds of a kusto timespan such as `00:00:01.5` or `1.02:00:00`."""
+    if isinstance(timespan, (int, float)):
+        return float(timespan)
+    days = 0
+    if '.' in timespan.split(':')[0]:
+        days, timespan = timespan.split('.', 1)
+    hours, minutes, seconds = timespan.split(':')
+    return ((int(days) * 24 + int(hours)) * 60 + int(minutes)) * 60 + float(seconds)
+
+
+def format_timespan(value):
+    """
+    Kusto timespan `d.hh:mm:ss[.fffffff]` of seconds or a timedelta, e.g.
+    `1.00:00:00` for a day, the format of the timespan request properties.
+    """
+    if not isinstance(value, timedelta):
+        value = timedelta(seconds=float(value))
+    ticks = ((value.days * 86400 + value.seconds) * 10 ** 6 + value.microseconds) * 10
+    if ticks < 0:
+        raise ValueError('Negative timespan {0!r}'.format(value))
+    seconds, fraction = divmod(ticks, 10 ** 7)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    timespan = '{0}.{1:02d}:{2:02d}:{3:02d}'.format(days, hours, minutes, seconds)
+    return timespan + '.{0:07d}'.format(fraction) if fraction else timespan
+
+
+def _get(payload, *keys):
+    for key in keys:
+        if not isinstance(payload, dict):
+            return None
+        payload = payload.get(key)
+    return payload
+
+
+def _sum(*values):
+    values = [v for v in values if v is not None]
+    return sum(values) if values else None
+
+
+def parse_resource_consumption(payload):
+    """Return the statistics of a `QueryResourceConsumption` payload."""
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+
+    usage = payload.get('resource_usage', {})
+    total_cpu = _get(usage, 'cpu', 'total cpu')
+    cache = usage.get('cache', {})
+    return {
+        'execution_time': payload.get('ExecutionTime'),
+        'cpu_time': timespan_seconds(total_cpu) if total_cpu is not None else None,
+        'memory_peak': _get(usage, 'memory', 'peak_per_node'),
+        'extents_total': _get(payload, 'input_dataset_statistics', 'extents', 'total'),
+        'extents_scanned': _get(payload, 'input_dataset_statistics', 'extents', 'scanned'),
+        'rows_total': _get(payload, 'input_dataset_statistics', 'rows', 'total'),
+        'rows_scanned': _get(payload, 'input_dataset_statistics', 'rows', 'scanned'),
+        'cache_hits': _sum(_get(cache, 'memory', 'hits'), _get(cache, 'disk', 'hits')),
+        'cache_misses': _sum(_get(cache, 'memory', 'misses'), _get(cache, 'disk', 'misses')),
+        'hot_cache_hit_bytes': _get(cache, 'shards', 'hot', 'hitbytes'),
+        'hot_cache_miss_bytes': _get(cache, 'shards', 'hot', 'missbytes'),
+        'result_size': _sum(*[_get(table, 'table_size') for table in payload.get('dataset_statistics') or []]),
+        'resource_consumption': payload,
+    }
+
+
+def query_stats(response):
+    """
+    Return the statistics of the query of a kusto response, from its query
+    completion information and its primary results, empty when the response
+    has no statistics. `partial_failure` is set when the query failed after
+    returning a part of its result.
+    """
+    stats = {}
+    try:
+        primary_results = response.primary_results
+        stats['result_rows'] = sum(len(table.raw_rows) for table in primary_results)
+
+        for table in response.tables:
+            if table.table_kind != WellKnownDataSet.QueryCompletionInformation:
+                continue
+            names = [column['ColumnName'] for column in table.raw_columns]
+            for row in table.raw_rows:
+                row = dict(zip(names, row))
+                if row.get('EventTypeName') == 'QueryResourceConsumption':
+                    stats.update(parse_resource_consumption(row['Payload']))
+                elif (row.get('Level') or PARTIAL_FAILURE_LEVEL) < PARTIAL_FAILURE_LEVEL:
+                    # e.g. a result truncated to the truncation request properties
+                    stats['partial_failure'] = True
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        logger.debug('No statistics in the response: %s', e)
+    return stats
@@ -1,7 +1,12 @@
 
 import re
 
+from mo_future import string_types
+
+from adx_db.exceptions import NotSupportedError
 from adx_db.formatting import format
+from adx_db.keywords import AGGREGATE_FUNCTIONS, OPERATOR_PLUGINS
+from adx_db.simplify import simplify
 
 
 def handle_superset_custom_events(query: str):
@@ -64,8 +69,172 @@ def preprocess(query: str):
     return parsed_query.strip()
 
 
-def translate(parsed_query: dict):
-    translate_query = format(parsed_query)
+def _is_union(json):
+    return isinstance(json, dict) and ('union' in json or 'union_all' in json)
+
+
+def _is_superset_kql(value):
+    # same mixture of sql and kql that `Formatter.from_` passes through verbatim
+    return (isinstance(value, string_types)
+            and value.find('|') > 0
+            and value.startswith('customEvents'))
+
+
+def _keeps_rows(json):
+    """
+    Return true if the clauses of a query neither filter, aggregate nor reorder
+    the rows of its source, so a limit on the query may also bound the source.
+    """
+    if any(key in json for key in ('where', 'groupby', 'having', 'orderby', 'offset')):
+        return False
+
+    select = json.get('select', '*')
+    if select == '*':
+        return True
+    if isinstance(select, dict):
+        select = [select]
+
+    for item in select:
+        value = item.get('value') if isinstance(item, dict) else item
+        if isinstance(value, dict) and value:
+            op = list(value.keys())[0].lower()
+            if op in AGGREGATE_FUNCTIONS or op in OPERATOR_PLUGINS or op == 'distinct':
+                return False
+    return True
+
+
+def _limit_source(source, limit):
+    """
+    Return `source` (a nested query, a union or superset raw kql) bounded by `limit`.
+    """
+    if _is_superset_kql(source):
+        return '{0} | limit {1}'.format(source, limit)
+
+    if _is_union(source):
+        key = 'union' if 'union' in source else 'union_all'
+        return dict(source, **{key: [_limit_source(branch, limit) for branch in source[key]]})
+
+    if isinstance(source, dict) and ('select' in source or 'from' in source):
+        inner_limit = source.get('limit')
+        if isinstance(inner_limit, int) and 0 <= inner_limit <= limit:
+            return push_down_limit(source)
+        return push_down_limit(dict(source, limit=limit))
+
+    return source
+
+
+def push_down_limit(json: dict):
+    """
+    Rewrite pass: copy the limit of a query into its nested query or into each
+    branch of its union, e.g. superset wraps every chart as
+
+    ```
+    SELECT name AS name FROM (SELECT name FROM customEvents) AS expr_qry LIMIT 1000
+    ```
+    which becomes
+    ```
+    (customEvents | project name | limit 1000) | project name=name | limit 1000
+    ```
+    so kusto does not materialise the whole inner result first.
+    The outer limit is kept, and nothing is pushed when a filter, aggregation
+    or order sits between the limit and the source.
+    """
+    if _is_union(json):
+        key = 'union' if 'union' in json else 'union_all'
+        return dict(json, **{key: [push_down_limit(branch) for branch in json[key]]})
+
+    if not isinstance(json, dict):
+        return json
+
+    limit = json.get('limit')
+    from_ = json.get('from')
+    if not isinstance(limit, int) or limit < 0 or not _keeps_rows(json):
+        return json
+
+    if isinstance(from_, dict) and 'value' in from_:
+        return dict(json, **{'from': dict(from_, value=_limit_source(from_['value'], limit))})
+    if _is_union(from_):
+        return dict(json, **{'from': _limit_source(from_, limit)})
+    return json
+
+
+def _default_order(json):
+    """
+    Return sort items for the plain columns selected by the query.
+    """
+    select = json.get('select', '*')
+    if not isinstance(select, list):
+        select = [select]
+
+    return [
+        {'value': item.get('name', item['value'])}
+        for item in select
+        if isinstance(item, dict) and isinstance(item.get('value'), string_types)
+    ]
+
+
+def paginate(parsed_query: dict, offset: int, limit: int, order_by=None):
+    """
+    Restrict a parsed query to the `limit` rows following the first `offset` rows.
+
+    Pages are only consistent with each other when the rows have the same
+    order on every execution, so the order of the query is used, else
+    `order_by` (column names or `{'value': column, 'sort': 'desc'}` items),
+    else the plain columns of the select.
+    A LIMIT/OFFSET already in the query bounds the pages.
+    """
+    if _is_union(parsed_query):
+        parsed_query = {'select': '*', 'from': {'value': parsed_query}}
+
+    orderby = parsed_query.get('orderby')
+    if not orderby and order_by:
+        orderby = [{'value': o} if isinstance(o, string_types) else o for o in order_by]
+    if not orderby:
+        orderby = _default_order(parsed_query)
+    if not orderby:
+        raise NotSupportedError('Paging needs a stable row order, add ORDER BY to the query or pass `order_by`')
+
+    query_offset, query_limit = parsed_query.get('offset', 0), parsed_query.get('limit')
+    if query_limit is not None:
+        limit = max(0, min(limit, query_limit - offset))
+
+    return dict(parsed_query, orderby=orderby, offset=query_offset + offset, limit=limit)
+
+
+def cap_rows(parsed_query: dict, limit: int):
+    """
+    Add `LIMIT limit` to a select statement which has no limit, so a whole
+    table is never read by mistake, e.g. `SELECT * FROM customEvents`.
+    """
+    if _is_union(parsed_query):
+        parsed_query = {'select': '*', 'from': {'value': parsed_query}}
+    if parsed_query.get('limit') is not None:
+        return parsed_query
+    return dict(parsed_query, limit=limit)
+
+
+# applied in order to the parsed query before it is formatted to kql
+REWRITE_PASSES = [
+    simplify,
+    push_down_limit,
+]
+
+
+def rewrite(parsed_query: dict, applied: list = None):
+    """
+    Apply the rewrite passes, the names of the passes which changed the
+    query are appended to `applied`.
+    """
+    for rewrite_pass in REWRITE_PASSES:
+        rewritten = rewrite_pass(parsed_query)
+        if applied is not None and rewritten != parsed_query:
+            applied.append(rewrite_pass.__name__)
+        parsed_query = rewritten
+    return parsed_query
+
+
+def translate(parsed_query: dict, applied: list = None):
+    translate_query = format(rewrite(parsed_query, applied))
 
 
     # todo below is for superset
@@ -3,7 +3,9 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import os
 import re
+import tempfile
 
 
 POSITION = re.compile(r'at line (?P<line>\d+), column (?P<column>\d+)')
@@ -60,3 +62,20 @@ Error{plural}:
         plural='s' if len(errors) > 1 else '',
         error_messages='\n'.join(error_messages),
     ).strip()
+
+
+def atomic_write(file_name, *chunks):
+    """
+    Write the strings `chunks` to `file_name` through a temporary file of its
+    directory, so other processes never read a partial file.
+    """
+    fd, temp_name = tempfile.mkstemp(dir=os.path.dirname(file_name), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(temp_name, file_name)
+    except OSError:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
@@ -0,0 +1,57 @@
+"""
+Benchmark the whole connect -> execute -> fetch path, through http and the
+kusto client, against the local fake cluster of `tests/fake_kusto.py`.
+
+    python benchmarks/bench_end_to_end.py
+
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from adx_db import connect  # noqa: E402
+from tests.fake_kusto import FakeKusto  # noqa: E402
+
+# rows of the results, and number of queries timed for each size
+SIZES = [(10, 200), (1000, 50), (50000, 5)]
+
+
+def bench(kusto, rows, repeat):
+    sql = 'SELECT timestamp, name, itemCount, duration, customDimensions FROM customEvents LIMIT {0}'.format(rows)
+    timings = {'connect': [], 'execute': [], 'fetch': []}
+    for _ in range(repeat + 1):
+        start = time.perf_counter()
+        conn = connect(host=kusto.host, scheme='http', path='authority/db', unauthenticated=True)
+        cursor = conn.cursor()
+        connected = time.perf_counter()
+        cursor.execute(sql)
+        executed = time.perf_counter()
+        fetched = cursor.fetchall()
+        done = time.perf_counter()
+        conn.close()
+
+        assert len(fetched) == rows
+        timings['connect'].append(connected - start)
+        timings['execute'].append(executed - connected)
+        timings['fetch'].append(done - executed)
+
+    # the first query opens the http connection
+    return {stage: statistics.median(values[1:]) for stage, values in timings.items()}
+
+
+def main():
+    print('{0:>8} {1:>12} {2:>12} {3:>12} {4:>12}'.format('rows', 'connect (ms)', 'execute (ms)', 'fetch (ms)',
+                                                          'rows/s'))
+    with FakeKusto(rows=max(rows for rows, _ in SIZES)) as kusto:
+        for rows, repeat in SIZES:
+            timing = bench(kusto, rows, repeat)
+            total = sum(timing.values())
+            print('{0:>8} {1:>12.3f} {2:>12.3f} {3:>12.3f} {4:>12.0f}'.format(
+                rows, timing['connect'] * 1e3, timing['execute'] * 1e3, timing['fetch'] * 1e3, rows / total))
+
+
+if __name__ == '__main__':
+    main()
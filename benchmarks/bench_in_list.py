@@ -0,0 +1,48 @@
+"""
+Benchmark sql -> kql translation of filters with very large IN lists.
+
+    python benchmarks/bench_in_list.py
+
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from adx_db.parse import parse  # noqa: E402
+from adx_db.translator import translate  # noqa: E402
+
+SIZES = [10000, 100000]
+
+
+def build_sql(size, quoted=True):
+    values = ("'user-{0}'".format(i) if quoted else str(i) for i in range(size))
+    return 'SELECT name, timestamp FROM customEvents WHERE user_Id IN ({0}) LIMIT 100'.format(', '.join(values))
+
+
+def bench(sql, repeat=3):
+    best_parse = best_translate = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parsed = parse(sql)
+        parsed_at = time.perf_counter()
+        kql = translate(parsed)
+        done = time.perf_counter()
+
+        best_parse = min(best_parse, parsed_at - start)
+        best_translate = min(best_translate, done - parsed_at)
+    return best_parse, best_translate, len(kql)
+
+
+def main():
+    print('{0:>8} {1:>8} {2:>10} {3:>12} {4:>10}'.format('values', 'type', 'parse (s)', 'translate (s)', 'kql chars'))
+    for size in SIZES:
+        for quoted in (True, False):
+            parse_time, translate_time, kql_size = bench(build_sql(size, quoted))
+            print('{0:>8} {1:>8} {2:>10.3f} {3:>12.3f} {4:>10}'.format(
+                size, 'string' if quoted else 'int', parse_time, translate_time, kql_size))
+
+
+if __name__ == '__main__':
+    main()
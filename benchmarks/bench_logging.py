@@ -0,0 +1,108 @@
+"""
+Benchmark the client-side cost of a query with the logging disabled, with
+debug logging and with every request in the query log, against a client
+answering at once so only adx_db itself is measured.
+
+    python benchmarks/bench_logging.py
+
+"""
+import io
+import logging
+import os
+import sys
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from adx_db import connect  # noqa: E402
+from adx_db.instrumentation import query_log  # noqa: E402
+
+QUERIES = 2000
+SQL = 'SELECT name, timestamp FROM customEvents WHERE itemCount > 2 ORDER BY timestamp LIMIT 10'
+
+
+class Table(object):
+
+    def __init__(self, rows, columns, table_kind=None):
+        self.raw_rows = rows
+        self.raw_columns = columns
+        self.table_kind = table_kind
+
+
+class Response(object):
+
+    def __init__(self):
+        columns = [{'ColumnName': 'name', 'ColumnType': 'string'},
+                   {'ColumnName': 'timestamp', 'ColumnType': 'datetime'}]
+        rows = [['event-{0}'.format(i), '2020-01-01T00:00:00Z'] for i in range(10)]
+        self.primary_results = [Table(rows, columns)]
+        self.tables = self.primary_results
+
+
+class Client(object):
+
+    def execute(self, database, query, properties=None):
+        return Response()
+
+
+def bench(cursor, queries=QUERIES):
+    cursor.execute(SQL)  # translation cache
+    start = time.perf_counter()
+    for _ in range(queries):
+        cursor.execute(SQL)
+        cursor.fetchall()
+    return (time.perf_counter() - start) / queries
+
+
+def configure(name):
+    """Configure the logging of a run, return a function restoring it."""
+    root = logging.getLogger('adx_db')
+    handler = logging.StreamHandler(io.StringIO())
+    level = root.level
+    if name == 'debug logging':
+        root.addHandler(handler)
+        root.setLevel(logging.DEBUG)
+    elif name == 'query log (all)':
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+        query_log.sample_rate = 1.0
+
+    def restore():
+        root.removeHandler(handler)
+        root.setLevel(level)
+        query_log.sample_rate = 0.0
+    return restore
+
+
+def bench_call(call, repeat=100000):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        call()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    print('{0:<20} {1:>14}'.format('logging', 'us per query'))
+    with mock.patch('adx_db.query.get_client', return_value=Client()):
+        cursor = connect(host='cluster', path='authority/db').cursor()
+        for name in ('disabled', 'debug logging', 'query log (all)'):
+            restore = configure(name)
+            try:
+                seconds = bench(cursor)
+            finally:
+                restore()
+            print('{0:<20} {1:>14.1f}'.format(name, seconds * 1e6))
+
+    # what the queries used to pay for their diagnostics, against a disabled log call
+    logger = logging.getLogger('adx_db.query')
+    with open(os.devnull, 'w') as devnull:
+        printed = bench_call(lambda: print('query: {}'.format(SQL), file=devnull))
+    logged = bench_call(lambda: logger.debug('Query on %s: %s', 'cluster', SQL))
+    print()
+    print('{0:<20} {1:>14.3f}'.format('print to devnull', printed * 1e6))
+    print('{0:<20} {1:>14.3f}'.format('disabled debug log', logged * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""
+Concurrent load against the fake cluster of `tests/fake_kusto.py`,
+simulating the dashboard sessions of a superset worker: each session
+replays the sql statements of the test corpora, one after the other,
+through `adx_db.connect` or a sqlalchemy engine. Reports the throughput,
+the p50/p95/p99 latency of each stage (connect, execute, fetch) and the
+peak RSS of the process.
+
+    python benchmarks/load.py --sessions 32 --duration 30
+    python benchmarks/load.py --sessions 32 --engine --mode asyncio
+
+Regression between two versions of the package, e.g. a worktree of the
+previous release (both must support the `unauthenticated` connection
+argument), with the same arguments:
+
+    git worktree add /tmp/adx_db-base <previous release>
+    python benchmarks/load.py --package /tmp/adx_db-base --output base.json
+    python benchmarks/load.py --output new.json
+    python benchmarks/load.py --compare base.json new.json
+
+"""
+import argparse
+import ast
+import asyncio
+import glob
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+STAGES = ['connect', 'execute', 'fetch', 'total']
+
+
+def corpus_statements(paths):
+    """
+    The sql select statements of the test files: strings assigned to `sql`
+    or passed to `parse`, in the order they appear.
+    """
+    statements = []
+    for path in paths:
+        with open(path) as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Assign) and any(getattr(t, 'id', None) == 'sql' for t in node.targets):
+                value = node.value
+            elif isinstance(node, ast.Call) and getattr(node.func, 'id', None) == 'parse' and node.args:
+                value = node.args[0]
+            else:
+                continue
+            if isinstance(value, ast.Constant) and isinstance(value.value, str) \
+                    and value.value.strip().lower().startswith('select'):
+                statements.append(value.value.strip())
+    return list(dict.fromkeys(statements))
+
+
+def translatable(statements):
+    """The statements translated by the package under test, without parameters to bind."""
+    import adx_db
+
+    kept = []
+    for sql in statements:
+        if '%' in sql:
+            continue
+        try:
+            kql = adx_db.get_kql(sql)
+        except Exception:
+            continue
+        if not kql.lstrip().startswith('.'):
+            kept.append(sql)
+    return kept
+
+
+def percentile(values, rank):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(rank / 100.0 * (len(values) - 1))))]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_fake_kusto(args):
+    """Run the fake cluster in its own process, so the RSS measured is the one of the client."""
+    port = free_port()
+    process = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, 'tests', 'fake_kusto.py'), '--port', str(port),
+        '--rows', str(args.rows), '--latency', str(args.latency), '--error-rate', str(args.error_rate),
+    ], stdout=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, '127.0.0.1:{0}'.format(port)
+        except OSError:
+            if time.time() > deadline or process.poll() is not None:
+                process.kill()
+                raise RuntimeError('The fake kusto server did not start')
+            time.sleep(0.05)
+
+
+class Client(object):
+    """Opens a connection and runs a statement, through adx_db or a sqlalchemy engine."""
+
+    def __init__(self, host, options, engine=False):
+        import adx_db
+
+        self.engine = None
+        self.connect_args = dict(host=host, scheme='http', path='authority/db', unauthenticated=True, **options)
+        self.connect = lambda: adx_db.connect(**self.connect_args)
+        if engine:
+            from sqlalchemy import create_engine
+            from sqlalchemy.dialects import registry
+            from urllib.parse import urlencode
+
+            registry.register('adx', 'adx_db.dialect', 'AdxDialect')
+            # run_query ignores the port of the url, the host of the fake cluster is passed with its port
+            query = urlencode(dict(options, host=host, scheme='http', unauthenticated='true'))
+            self.engine = create_engine('adx://127.0.0.1/authority/db?{0}'.format(query), pool_size=64,
+                                        max_overflow=64)
+            self.connect = self.engine.connect
+
+    def run(self, sql):
+        """Return the seconds of each stage of a statement."""
+        start = time.perf_counter()
+        connection = self.connect()
+        try:
+            connected = time.perf_counter()
+            if self.engine is not None:
+                result = connection.execute(sql)
+            else:
+                result = connection.cursor()
+                result.execute(sql)
+            executed = time.perf_counter()
+            result.fetchall()
+            done = time.perf_counter()
+        finally:
+            connection.close()
+        return {'connect': connected - start, 'execute': executed - connected, 'fetch': done - executed,
+                'total': done - start}
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.timings = {stage: [] for stage in STAGES}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, client, sql):
+        try:
+            timing = client.run(sql)
+        except Exception as e:
+            with self._lock:
+                name = type(e).__name__
+                self.errors[name] = self.errors.get(name, 0) + 1
+            return
+        with self._lock:
+            for stage, seconds in timing.items():
+                self.timings[stage].append(seconds)
+
+
+def session(client, statements, offset, deadline, recorder):
+    """A dashboard session: the statements in turn, starting at `offset`, until the deadline."""
+    index = offset
+    while time.time() < deadline:
+        recorder.record(client, statements[index % len(statements)])
+        index += 1
+
+
+def run_threads(client, statements, args, recorder):
+    deadline = time.time() + args.duration
+    threads = [threading.Thread(target=session, args=(client, statements, i, deadline, recorder))
+               for i in range(args.sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_asyncio(client, statements, args, recorder):
+    # adx_db is synchronous, the tasks run its calls on threads as an asyncio application would
+    executor = ThreadPoolExecutor(max_workers=args.sessions)
+
+    async def task(offset, deadline):
+        loop = asyncio.get_event_loop()
+        index = offset
+        while time.time() < deadline:
+            await loop.run_in_executor(executor, recorder.record, client, statements[index % len(statements)])
+            index += 1
+
+    async def main():
+        deadline = time.time() + args.duration
+        await asyncio.gather(*[task(i, deadline) for i in range(args.sessions)])
+
+    asyncio.get_event_loop().run_until_complete(main())
+    executor.shutdown()
+
+
+def load(args):
+    sys.path.insert(0, os.path.abspath(args.package))
+    import adx_db
+
+    statements = translatable(corpus_statements(sorted(glob.glob(os.path.join(ROOT, 'tests', 'test_*.py')))))
+    if not statements:
+        raise RuntimeError('No statement of the corpora is translated by {0}'.format(adx_db.__file__))
+
+    process, host = (None, args.host) if args.host else start_fake_kusto(args)
+    try:
+        options = dict(option.split('=', 1) for option in args.option)
+        client = Client(host, options, args.engine)
+        for sql in statements:  # warm up the translation cache and the connection pool
+            Recorder().record(client, sql)
+
+        recorder = Recorder()
+        start = time.time()
+        (run_asyncio if args.mode == 'asyncio' else run_threads)(client, statements, args, recorder)
+        elapsed = time.time() - start
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    queries = len(recorder.timings['total'])
+    return {
+        'package': os.path.dirname(os.path.abspath(adx_db.__file__)),
+        'mode': args.mode,
+        'engine': args.engine,
+        'sessions': args.sessions,
+        'statements': len(statements),
+        'queries': queries,
+        'errors': recorder.errors,
+        'throughput': queries / elapsed,
+        # kilobytes on linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        'latency_ms': {
+            stage: {'p{0}'.format(rank): percentile(values, rank) * 1e3 if values else None for rank in (50, 95, 99)}
+            for stage, values in recorder.timings.items()
+        },
+    }
+
+
+def metrics(report):
+    yield 'throughput (q/s)', report['throughput']
+    yield 'peak rss (MB)', report['peak_rss_mb']
+    for stage in STAGES:
+        for rank, value in sorted(report['latency_ms'][stage].items()):
+            yield '{0} {1} (ms)'.format(stage, rank), value
+
+
+def print_report(report):
+    print('{0} ({1}{2}), {3} sessions replaying {4} statements: {5} queries, errors: {6}'.format(
+        report['package'], report['mode'], ', engine' if report['engine'] else '', report['sessions'],
+        report['statements'], report['queries'], report['errors'] or 'none'))
+    for name, value in metrics(report):
+        print('{0:<22} {1:>10.3f}'.format(name, value if value is not None else float('nan')))
+
+
+def compare(base_path, new_path):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print('{0:<22} {1:>10} {2:>10} {3:>8}'.format('', 'base', 'new', 'change'))
+    for (name, before), (_, after) in zip(metrics(base), metrics(new)):
+        change = '{0:+.1%}'.format(after / before - 1) if before and after is not None else ''
+        print('{0:<22} {1:>10.3f} {2:>10.3f} {3:>8}'.format(name, before or 0.0, after or 0.0, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sessions', type=int, default=16, help='concurrent dashboard sessions')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load')
+    parser.add_argument('--mode', choices=['threads', 'asyncio'], default='threads')
+    parser.add_argument('--engine', action='store_true', help='through a sqlalchemy engine and its pool')
+    parser.add_argument('--option', action='append', default=[],
+                        help='connection argument NAME=VALUE, e.g. result_cache_ttl=60')
+    parser.add_argument('--package', default=ROOT, help='directory of the adx_db package to load')
+    parser.add_argument('--host', help='host:port of a running fake cluster, else one is started')
+    parser.add_argument('--rows', type=int, default=100, help='rows of the results of the fake cluster')
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds of each query on the fake cluster')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--output', help='also write the report to this json file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two json reports')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = load(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,3 +5,14 @@ sys.path.insert(0, os.path.abspath(
     os.path.join(os.path.dirname(__file__), '..')))
 
 
+
+import adx_db
+from adx_db import connect, exceptions
+from adx_db.db import Connection
+from adx_db.dialect import AdxDialect
+from adx_db.translator import translate, preprocess, handle_superset_custom_events, paginate
+from adx_db.parse import parse
+from adx_db.query import batches, build_request_properties, clear_translation_cache
+from adx_db import admission, circuit_breaker, instrumentation, query, result_cache
+from adx_db.execution import RetryPolicy
+from adx_db.statistics import format_timespan, timespan_seconds
@@ -0,0 +1,253 @@
+"""
+Stand-in Kusto cluster speaking enough of the REST protocol (v2 queries and
+v1 control commands) for adx_db to run end to end without a live cluster.
+Every query returns synthetic rows, with a configurable latency and rate of
+failures, truncated as a cluster does with the `truncationmaxrecords` option.
+
+In process, connect without authentication:
+
+    with FakeKusto(rows=1000, latency=0.005) as kusto:
+        conn = adx_db.connect(host=kusto.host, scheme='http', path='authority/db', unauthenticated=True)
+
+Or as a process:
+
+    python tests/fake_kusto.py --port 8080 --rows 1000 --latency 0.005
+
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# columns of the synthetic results, as `(name, kusto type)`
+COLUMNS = [
+    ('timestamp', 'datetime'),
+    ('name', 'string'),
+    ('itemCount', 'long'),
+    ('duration', 'real'),
+    ('customDimensions', 'dynamic'),
+]
+
+# the last `take`/`limit` of a query bounds its number of rows
+LIMIT = re.compile(r'\|\s*(?:take|limit)\s+(\d+)\s*$', re.IGNORECASE)
+
+START = datetime(2020, 1, 1)
+
+
+def truncation_error(max_records: int):
+    """
+    The error of a result truncated by the cluster, a row of its table or,
+    with the `deferpartialqueryfailures` option, a row of the
+    QueryCompletionInformation.
+    """
+    return {'OneApiErrors': [{'error': {
+        'code': 'LimitsExceeded',
+        'message': 'Request is invalid and cannot be executed.',
+        '@type': 'Kusto.Data.Exceptions.KustoServicePartialQueryFailureLimitsExceededException',
+        '@message': 'Query execution has exceeded the allowed limits (80DA0003): The results of this query exceed '
+                    'the set limit of {0} records, so not all records were returned '
+                    '(E_QUERY_RESULT_SET_TOO_LARGE).'.format(max_records),
+        '@permanent': False,
+    }}]}
+
+
+def synthetic_row(index: int, string_size: int = 16):
+    return [
+        (START + timedelta(seconds=index)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'event-{0}-'.format(index % 100).ljust(string_size, 'x'),
+        index % 1000,
+        index / 7.0,
+        {'session': 'session-{0}'.format(index % 50), 'index': index},
+    ]
+
+
+@lru_cache(maxsize=64)
+def encoded_rows(count: int, string_size: int):
+    """The json of `count` rows, encoded once, so the server is not what is measured."""
+    return json.dumps([synthetic_row(i, string_size) for i in range(count)])
+
+
+def statements(query: str):
+    """The tabular statements of a request, a batch has several of them."""
+    return [s for s in query.split(';') if s.strip() and not s.strip().startswith('let ')]
+
+
+class FakeKusto(object):
+    """
+    A local http server answering the queries of adx_db with `rows` rows of
+    `COLUMNS` (fewer when the query ends with `take`/`limit`), after
+    `latency` seconds. A request fails with `error_status` (e.g. 429 for
+    throttling) with the probability `error_rate`.
+    """
+
+    def __init__(self, rows: int = 100, latency: float = 0.0, error_rate: float = 0.0, error_status: int = 503,
+                 string_size: int = 16, port: int = 0, seed: int = None):
+        self.rows = rows
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.string_size = string_size
+        self.requests = 0
+        self.queries = []  # text of the requests, most recent last
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), _handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def host(self):
+        """Host of the server for `adx_db.connect`, to use with `scheme='http'` and `unauthenticated=True`."""
+        return '{0}:{1}'.format(*self._server.server_address)
+
+    @property
+    def url(self):
+        return 'http://{0}'.format(self.host)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-kusto', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _record(self, query):
+        with self._lock:
+            self.requests += 1
+            self.queries.append(query)
+            del self.queries[:-1000]
+            return self._random.random() < self.error_rate
+
+    def respond(self, endpoint: str, request: dict):
+        """Return the http status and the body of a request."""
+        query = request.get('csl', '')
+        failed = self._record(query)
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            return self.error_status, json.dumps({'error': {
+                'code': 'ServiceUnavailable' if self.error_status != 429 else 'TooManyRequests',
+                '@message': 'Synthetic failure of the fake cluster',
+            }})
+
+        if endpoint == '/v1/rest/mgmt':
+            return 200, self._v1_response(query)
+        options = json.loads(request.get('properties') or '{}').get('Options', {})
+        return 200, self._v2_response(query, options)
+
+    def _count(self, statement: str):
+        limit = LIMIT.search(statement.strip())
+        return min(self.rows, int(limit.group(1))) if limit else self.rows
+
+    def _v2_response(self, query: str, options: dict):
+        columns = json.dumps([{'ColumnName': name, 'ColumnType': kind} for name, kind in COLUMNS])
+        frames = ['{"FrameType": "DataSetHeader", "IsProgressive": false, "Version": "v2.0"}']
+        max_records = options.get('truncationmaxrecords')
+        defer_failures = options.get('deferpartialqueryfailures', False)
+        errors = []
+        total = 0
+        for table_id, statement in enumerate(statements(query) or [query]):
+            count = self._count(statement)
+            rows = None
+            if max_records is not None and count > int(max_records):
+                count = int(max_records)
+                error = truncation_error(count)
+                errors.append(error)
+                if not defer_failures:
+                    rows = json.dumps(json.loads(encoded_rows(count, self.string_size)) + [error])
+            total += count
+            frames.append('{{"FrameType": "DataTable", "TableId": {0}, "TableKind": "PrimaryResult", '
+                          '"TableName": "PrimaryResult", "Columns": {1}, "Rows": {2}}}'.format(
+                              table_id, columns, rows or encoded_rows(count, self.string_size)))
+
+        consumption = {
+            'ExecutionTime': self.latency,
+            'resource_usage': {'cpu': {'total cpu': '00:00:00.0010000'}, 'memory': {'peak_per_node': 1048576},
+                               'cache': {'memory': {'hits': 1, 'misses': 0}, 'disk': {'hits': 0, 'misses': 0}}},
+            'input_dataset_statistics': {'extents': {'total': 10, 'scanned': 10},
+                                         'rows': {'total': self.rows, 'scanned': total}},
+            'dataset_statistics': [{'table_row_count': total, 'table_size': total * 64}],
+        }
+        frames.append(json.dumps({
+            'FrameType': 'DataTable', 'TableId': len(frames), 'TableKind': 'QueryCompletionInformation',
+            'TableName': 'QueryCompletionInformation',
+            'Columns': [{'ColumnName': 'Level', 'ColumnType': 'int'},
+                        {'ColumnName': 'EventTypeName', 'ColumnType': 'string'},
+                        {'ColumnName': 'Payload', 'ColumnType': 'string'}],
+            'Rows': [[4, 'QueryResourceConsumption', json.dumps(consumption)]]
+                    + [[2, 'QueryInfo', json.dumps(error)] for error in errors if defer_failures],
+        }))
+        completion = {'FrameType': 'DataSetCompletion', 'HasErrors': bool(errors), 'Cancelled': False}
+        if errors:
+            completion['OneApiErrors'] = [error['OneApiErrors'][0] for error in errors]
+        frames.append(json.dumps(completion))
+        return '[{0}]'.format(', '.join(frames))
+
+    def _v1_response(self, command: str):
+        if command.startswith('.cancel query') or command.startswith('.drop '):
+            columns, rows = [('Status', 'string')], '[["done"]]'
+        else:
+            columns, rows = COLUMNS, encoded_rows(self._count(command), self.string_size)
+        columns = json.dumps([{'ColumnName': name, 'DataType': kind.capitalize(), 'ColumnType': kind}
+                              for name, kind in columns])
+        return '{{"Tables": [{{"TableName": "Table_0", "Columns": {0}, "Rows": {1}}}]}}'.format(columns, rows)
+
+
+def _handler(kusto: FakeKusto):
+
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive, as a cluster does, so the connection pool of the client is used
+        protocol_version = 'HTTP/1.1'
+        # the headers and the body are written separately, without delay
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            request = json.loads(self.rfile.read(length) or b'{}')
+            status, body = kusto.respond(self.path, request)
+            body = body.encode('utf8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each response')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--string-size', type=int, default=16)
+    args = parser.parse_args()
+
+    kusto = FakeKusto(args.rows, args.latency, args.error_rate, args.error_status, args.string_size, args.port)
+    print('Fake kusto listening on {0}'.format(kusto.url))
+    try:
+        kusto._server.serve_forever()
+    except KeyboardInterrupt:
+        kusto.stop()
+
+
+if __name__ == '__main__':
+    main()
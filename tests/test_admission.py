@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+from unittest import mock
+
+from .context import admission, connect, exceptions, instrumentation, query
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.005)
+
+
+class AdmissionTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        instrumentation.metrics.reset()
+
+    def test_priority_order(self):
+        limiter = admission.Limiter('cluster', limit=1)
+        limiter.acquire()
+        admitted = []
+
+        def acquire(name, priority):
+            limiter.acquire(priority, timeout=5)
+            admitted.append(name)
+
+        threads = []
+        for name, priority in [('report', 'scheduled'), ('chart 1', 'interactive'), ('chart 2', 'interactive')]:
+            threads.append(threading.Thread(target=acquire, args=(name, priority)))
+            threads[-1].start()
+            wait_for(lambda: limiter.waiting == len(threads))
+
+        for count in range(1, len(threads) + 1):
+            limiter.release()
+            wait_for(lambda: len(admitted) == count)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(admitted, ['chart 1', 'chart 2', 'report'])
+        self.assertEqual(instrumentation.metrics.snapshot()['admission_queue_depth']['max'], 3)
+
+    def test_queue_timeout_and_size(self):
+        limiter = admission.Limiter('cluster', limit=1, max_queue=1)
+        limiter.acquire()
+
+        with self.assertRaises(exceptions.OperationalError):
+            limiter.acquire(timeout=0.01)
+        self.assertEqual(limiter.waiting, 0)
+
+        thread = threading.Thread(target=limiter.acquire, kwargs={'timeout': 5})
+        thread.start()
+        wait_for(lambda: limiter.waiting == 1)
+        with self.assertRaises(exceptions.OperationalError):
+            limiter.acquire(timeout=5)
+        limiter.release()
+        thread.join()
+
+        metrics = instrumentation.metrics.snapshot()
+        self.assertEqual((metrics['admission_timeouts'], metrics['admission_rejections']), (1, 1))
+        self.assertEqual(limiter.running, 1)
+
+    @mock.patch('adx_db.query.get_client')
+    def test_database_limit(self, m):
+        release = threading.Event()
+        response = mock.Mock(primary_results=[mock.Mock(raw_rows=[], raw_columns=[])])
+        m.return_value.execute.side_effect = lambda *args: release.wait(5) and response
+        control = admission.AdmissionControl(database_limit=1, queue_timeout=0.05)
+
+        with mock.patch.object(query, 'admission_control', control):
+            thread = threading.Thread(target=connect(path='authority/db').execute, args=('T | take 1',))
+            thread.start()
+            wait_for(lambda: m.return_value.execute.called)
+
+            with self.assertRaises(exceptions.OperationalError):
+                connect(path='authority/db').execute('T | take 2')
+            release.set()
+            thread.join()
+
+        self.assertEqual(m.return_value.execute.call_count, 1)
+
+    def test_unknown_priority(self):
+        with self.assertRaises(exceptions.ProgrammingError):
+            connect(priority='urgent')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest import mock
+
+from .context import connect, exceptions, instrumentation
+from .fake_kusto import FakeKusto
+
+COLUMNS = [{'ColumnName': 'name', 'ColumnType': 'string'}]
+
+
+class BudgetTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        instrumentation.metrics.reset()
+
+    @mock.patch('adx_db.query.run_query', return_value=([['a']], COLUMNS))
+    def test_row_cap(self, m):
+        conn = connect(path='authority/db', max_rows=2)
+        conn.execute('SELECT name FROM customEvents')
+        conn.execute('SELECT name FROM customEvents LIMIT 10')
+        conn.execute('SELECT name FROM customEvents UNION ALL SELECT name FROM customEvents')
+        conn.execute('customEvents | project name')
+
+        queries = [call[0][6] for call in m.call_args_list]
+        self.assertEqual(queries[0], 'customEvents | project name | limit 3')
+        self.assertEqual(queries[1], 'customEvents | project name | limit 10')
+        self.assertTrue(queries[2].endswith('| limit 3'))
+        self.assertEqual(queries[3], 'customEvents | project name')
+
+        # raw kql is truncated by the cluster
+        properties = m.call_args_list[3][0][7]
+        self.assertEqual(properties.get_option('truncationmaxrecords', None), 3)
+        self.assertFalse(properties.has_option('truncationmaxsize'))
+
+    @mock.patch('adx_db.query.run_query', return_value=([['a']], COLUMNS))
+    def test_request_options(self, m):
+        conn = connect(path='authority/db', max_rows=2, max_bytes=1000)
+        conn.execute('customEvents | project name')
+        conn.execute('customEvents | project name', request_properties={'truncation_max_records': 10})
+
+        properties = m.call_args_list[0][0][7]
+        self.assertEqual(properties.get_option('truncationmaxrecords', None), 3)
+        self.assertEqual(properties.get_option('truncationmaxsize', None), 1000)
+        self.assertTrue(properties.get_option('deferpartialqueryfailures', None))
+        self.assertEqual(m.call_args_list[1][0][7].get_option('truncationmaxrecords', None), 10)
+
+    def test_truncated_by_cluster(self):
+        with FakeKusto(rows=20) as kusto:
+            cursor = connect(host=kusto.host, scheme='http', path='authority/db', unauthenticated=True,
+                             max_rows=5).cursor()
+            with self.assertLogs('adx_db.budget', 'WARNING'):
+                cursor.execute('customEvents | project name')
+
+            self.assertTrue(cursor.truncated)
+            self.assertTrue(cursor.query_stats['partial_failure'])
+            self.assertEqual(len(cursor.fetchall()), 5)
+
+            # without deferring it, the truncation is an error row failing the query
+            with self.assertRaises(exceptions.OperationalError):
+                cursor.execute('customEvents | project name', request_properties={
+                    'truncation_max_records': 6, 'defer_partial_query_failures': False})
+
+    def test_explain_cap_rows(self):
+        cursor = connect(path='authority/db', max_rows=2).cursor()
+        self.assertEqual(cursor.explain('SELECT name FROM customEvents')['rewrites'], ['cap_rows'])
+        self.assertEqual(cursor.explain('SELECT name FROM customEvents LIMIT 1')['rewrites'], [])
+
+    @mock.patch('adx_db.query.run_query', return_value=([['a'], ['b'], ['c']], COLUMNS))
+    def test_truncate_rows(self, m):
+        cursor = connect(path='authority/db', max_rows=2).cursor()
+        with self.assertLogs('adx_db.budget', 'WARNING'):
+            cursor.execute('customEvents | project name')
+
+        self.assertTrue(cursor.truncated)
+        self.assertTrue(cursor.query_stats['truncated'])
+        self.assertEqual([row.name for row in cursor.fetchall()], ['a', 'b'])
+        self.assertEqual(instrumentation.metrics.snapshot()['results_truncated'], 1)
+
+        m.return_value = ([['a']], COLUMNS)
+        cursor.execute('customEvents | project name | take 1')
+        self.assertFalse(cursor.truncated)
+
+    @mock.patch('adx_db.query.run_query', return_value=([['a' * 10], ['b' * 10], ['c' * 10]], COLUMNS))
+    def test_truncate_bytes(self, m):
+        cursor = connect(path='authority/db', max_bytes=40, result_cache_ttl=60).cursor()
+        with self.assertLogs('adx_db.budget', 'WARNING'):
+            cursor.execute('customEvents | project name')
+            # truncated results are not served from memory
+            cursor.execute('customEvents | project name')
+
+        self.assertTrue(cursor.truncated)
+        self.assertEqual(len(cursor.fetchall()), 2)
+        self.assertEqual(m.call_count, 2)
+
+    @mock.patch('adx_db.query.run_query', return_value=([['a'], ['b'], ['c']], COLUMNS))
+    def test_raise_beyond_budget(self, m):
+        cursor = connect(path='authority/db', max_rows='2', on_budget_exceeded='raise').cursor()
+        with self.assertRaises(exceptions.OperationalError):
+            cursor.execute('customEvents | project name')
+
+    @mock.patch('adx_db.query.run_query')
+    def test_stored_result(self, m):
+        rows = [[str(i)] for i in range(11)]
+        m.side_effect = [([], COLUMNS), (rows[:8], COLUMNS), (rows[8:], COLUMNS), ([], [])]
+        cursor = connect(path='authority/db', max_rows=10, on_budget_exceeded='raise', stored_result_ttl='1h').cursor()
+        cursor.arraysize = 8
+        cursor.execute('SELECT name FROM customEvents')
+        self.assertEqual(len(cursor.fetchmany()), 8)
+        with self.assertRaises(exceptions.OperationalError):
+            cursor.fetchall()
+
+        command, properties = m.call_args_list[0][0][6:8]
+        self.assertIn('<| customEvents | project name | limit 11 |', command)
+        self.assertEqual(properties.get_option('truncationmaxrecords', None), 11)
+        self.assertTrue(properties.get_option('deferpartialqueryfailures', None))
+        # the stored result beyond the budget is dropped
+        self.assertTrue(m.call_args_list[3][0][6].startswith('.drop stored_query_result'))
+        self.assertIsNone(cursor.fetchone())
+
+        m.side_effect = [([], COLUMNS), (rows[:8], COLUMNS), (rows[8:], COLUMNS)]
+        cursor = connect(path='authority/db', max_rows=10, stored_result_ttl='1h').cursor()
+        cursor.arraysize = 8
+        cursor.execute('SELECT name FROM customEvents')
+        self.assertFalse(cursor.truncated)
+        with self.assertLogs('adx_db.budget', 'WARNING'):
+            self.assertEqual(len(cursor.fetchall()), 10)
+        self.assertTrue(cursor.truncated)
+        self.assertTrue(cursor.query_stats['truncated'])
+
+    def test_unknown_action(self):
+        with self.assertRaises(exceptions.ProgrammingError):
+            connect(max_rows=10, on_budget_exceeded='ignore')
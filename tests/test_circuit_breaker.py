@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+from unittest import mock
+
+from azure.kusto.data.exceptions import KustoServiceError
+
+from .context import circuit_breaker, connect, exceptions, instrumentation, query
+
+
+class CircuitBreakerTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        instrumentation.add_hook(self.hook)
+
+    def tearDown(self):
+        instrumentation.remove_hook(self.hook)
+
+    def hook(self, event, data):
+        if event == 'circuit_breaker':
+            self.events.append((data['previous'], data['state']))
+
+    def test_states(self):
+        breaker = circuit_breaker.CircuitBreaker('cluster', min_requests=4, failure_rate=0.5, reset_timeout=0.05)
+        for failed in (False, True, False):
+            breaker.allow()
+            breaker.record(failed)
+        self.assertEqual(breaker.state, circuit_breaker.CLOSED)
+
+        breaker.allow()
+        breaker.record(True)
+        self.assertEqual(breaker.state, circuit_breaker.OPEN)
+        with self.assertRaises(exceptions.OperationalError):
+            breaker.allow()
+
+        time.sleep(0.06)
+        breaker.allow()  # probe
+        with self.assertRaises(exceptions.OperationalError):
+            breaker.allow()
+        breaker.record(True)
+        self.assertEqual(breaker.state, circuit_breaker.OPEN)
+
+        time.sleep(0.06)
+        breaker.allow()
+        breaker.record(False)
+        self.assertEqual(breaker.state, circuit_breaker.CLOSED)
+
+        self.assertEqual(self.events, [
+            ('closed', 'open'),
+            ('open', 'half_open'),
+            ('half_open', 'open'),
+            ('open', 'half_open'),
+            ('half_open', 'closed'),
+        ])
+
+    @mock.patch('adx_db.query.get_client')
+    def test_fail_fast(self, m):
+        m.return_value.execute.side_effect = KustoServiceError('unavailable', mock.Mock(status_code=503, headers={}))
+        conn = connect(host='cluster', path='authority/db', retry_policy=1)
+
+        with mock.patch.object(query, 'circuit_breakers', circuit_breaker.CircuitBreakers(min_requests=2)):
+            for _ in range(4):
+                with self.assertRaises(exceptions.OperationalError):
+                    conn.execute('customEvents | take 1')
+
+        self.assertEqual(m.return_value.execute.call_count, 2)
+        self.assertEqual(self.events, [('closed', 'open')])
+
+    @mock.patch('adx_db.query.get_client')
+    def test_errors_of_the_query(self, m):
+        m.return_value.execute.side_effect = KustoServiceError('Semantic error', mock.Mock(status_code=400))
+        conn = connect(host='cluster', path='authority/db')
+
+        with mock.patch.object(query, 'circuit_breakers', circuit_breaker.CircuitBreakers(min_requests=2)):
+            for _ in range(4):
+                with self.assertRaises(exceptions.OperationalError):
+                    conn.execute('customEvents | take')
+
+        self.assertEqual(m.return_value.execute.call_count, 4)
+
+
+    @mock.patch('adx_db.query.get_client')
+    def test_timeouts(self, m):
+        cancelled = threading.Event()
+
+        def execute(db, kql, properties=None):
+            if kql.startswith('.cancel query'):
+                return mock.Mock()
+            cancelled.wait(5)  # a hung cluster
+            raise Exception('Query was cancelled')
+
+        m.return_value.execute.side_effect = execute
+        self.addCleanup(cancelled.set)
+        conn = connect(host='cluster', path='authority/db', retry_policy=1)
+        breakers = circuit_breaker.CircuitBreakers(min_requests=2)
+
+        with mock.patch.object(query, 'circuit_breakers', breakers):
+            for i in range(2):
+                with self.assertRaises(exceptions.OperationalError):
+                    conn.execute('customEvents | take {0}'.format(i), timeout=0.05)
+            # the outcome of a query given up is recorded once it is cancelled
+            deadline = time.time() + 5
+            while breakers.get('https://cluster').state != circuit_breaker.OPEN and time.time() < deadline:
+                time.sleep(0.01)
+
+            with self.assertRaisesRegex(exceptions.OperationalError, 'unhealthy'):
+                conn.execute('customEvents | take 1', timeout=0.05)
+
+        self.assertEqual(self.events, [('closed', 'open')])
+
+if __name__ == '__main__':
+    unittest.main()
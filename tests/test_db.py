@@ -1,11 +1,27 @@
 # -*- coding: utf-8 -*-
 
+import json
+import threading
+import time
 import unittest
+from datetime import timedelta
+from unittest import mock
+
+from azure.kusto.data._models import WellKnownDataSet
 
 from .context import (
     connect,
     exceptions,
-    Connection
+    Connection,
+    batches,
+    build_request_properties,
+    clear_translation_cache,
+    instrumentation,
+    format_timespan,
+    parse,
+    query,
+    RetryPolicy,
+    timespan_seconds
 )
 
 
@@ -27,6 +43,410 @@ class DBTestSuite(unittest.TestCase):
         self.assertTrue(cursor1.closed)
         self.assertTrue(cursor2.closed)
 
+    @mock.patch('adx_db.db.execute', return_value=([], []))
+    def test_cursor_execute_page(self, m):
+        cursor = connect().cursor()
+        cursor.execute_page('SELECT name FROM customEvents', page=2, page_size=50, order_by=['timestamp'])
+        cursor.next_page()
+
+        self.assertEqual(m.call_args_list[0][1]['page'], (100, 50, ['timestamp']))
+        self.assertEqual(m.call_args_list[1][1]['page'], (150, 50, ['timestamp']))
+
+    @mock.patch('adx_db.db.execute', return_value=([['a']], [('name', 'string')]))
+    def test_cursor_execute_page_error(self, m):
+        cursor = connect().cursor()
+        cursor.execute('SELECT name FROM customEvents')
+
+        m.side_effect = exceptions.NotSupportedError('Paging is only supported for SQL select statements')
+        with self.assertRaises(exceptions.NotSupportedError):
+            cursor.execute_page('customEvents | project name', order_by=['name'])
+        self.assertIsNone(cursor.description)
+        self.assertIsNone(cursor.fetchone())
+
+    @mock.patch('adx_db.query.run_query')
+    def test_cursor_stored_result(self, m):
+        columns = [{'ColumnName': 'name', 'ColumnType': 'string'}]
+        m.side_effect = [
+            ([], columns),                  # .set stored_query_result
+            ([['a'], ['b']], columns),      # first page
+            ([['c']], columns),             # remaining rows
+            ([], []),                       # .drop stored_query_result
+        ]
+
+        retry_policy = RetryPolicy(max_attempts=2)
+        conn = connect(stored_result_ttl='1h', timeout=30, priority='scheduled', query_consistency='weak',
+                       retry_policy=retry_policy)
+        cursor = conn.cursor()
+        cursor.arraysize = 2
+        cursor.execute('customEvents | project name')
+
+        self.assertEqual(cursor.description[0][0], 'name')
+        self.assertEqual(cursor.rowcount, -1)
+        self.assertEqual([row.name for row in cursor.fetchall()], ['a', 'b', 'c'])
+
+        conn.close()
+
+        queries = [call[0][6] for call in m.call_args_list]
+        name = queries[0].split()[2]
+        self.assertTrue(name.startswith('adx_db_'))
+        self.assertEqual(
+            queries[0],
+            '.set stored_query_result {0} with (previewCount = 0, expiresAfter = 1h) <| '
+            'customEvents | project name | serialize __row_number=row_number()'.format(name))
+        self.assertIn("stored_query_result('{0}') | where __row_number > 0 and __row_number <= 2".format(name), queries[1])
+        self.assertIn('| where __row_number > 2 |', queries[2])
+        self.assertEqual(queries[3], '.drop stored_query_result {0}'.format(name))
+        # reading the pages is retried
+        self.assertEqual([call[1].get('retry_policy') for call in m.call_args_list[1:3]], [retry_policy] * 2)
+        for call in m.call_args_list:
+            self.assertEqual(call[0][7].get_option('queryconsistency', None), 'weakconsistency')
+            self.assertEqual(call[0][8], 30)
+            self.assertIsNotNone(call[0][9])
+            self.assertEqual(call[1]['priority'], 'scheduled')
+
+    @mock.patch('adx_db.query.get_client')
+    def test_connection_ping(self, m):
+        conn = connect(host='cluster', path='authority/db')
+        latency = conn.ping(timeout=2)
+
+        db, query, properties = m.return_value.execute.call_args[0]
+        self.assertEqual((db, query), ('db', 'print 1'))
+        self.assertEqual(properties.get_option('servertimeout', None), '0.00:00:02')
+        self.assertEqual(conn.stats['last_ping_latency'], latency)
+        self.assertEqual((conn.stats['pings'], conn.stats['ping_failures']), (1, 0))
+
+        m.return_value.execute.side_effect = Exception('throttled')
+        with self.assertRaises(exceptions.OperationalError):
+            conn.ping()
+        self.assertIsNone(conn.stats['last_ping_latency'])
+        self.assertEqual((conn.stats['pings'], conn.stats['ping_failures']), (2, 1))
+
+    @mock.patch('adx_db.query.get_client')
+    def test_connection_ping_timeout(self, m):
+        m.return_value.execute.side_effect = lambda *args: time.sleep(0.5)
+
+        conn = connect(host='cluster', path='authority/db')
+        with self.assertRaises(exceptions.OperationalError):
+            conn.ping(timeout=0.05)
+        self.assertEqual(conn.stats['ping_failures'], 1)
+
+    @mock.patch('adx_db.query.run_query', return_value=([], []))
+    def test_translation_cache(self, m):
+        clear_translation_cache()
+        cursor = connect().cursor()
+        with mock.patch('adx_db.query.parse_sql', wraps=parse) as parse_sql:
+            for _ in range(3):
+                cursor.execute('SELECT name FROM customEvents WHERE itemCount > %(count)s', {'count': 2})
+            cursor.execute('SELECT name FROM customEvents WHERE itemCount > %(count)s', {'count': 3})
+
+        self.assertEqual(parse_sql.call_count, 2)
+        self.assertEqual(m.call_args_list[0][0][6], m.call_args_list[2][0][6])
+        self.assertIn('itemCount > 3', m.call_args_list[3][0][6])
+
+    @mock.patch('adx_db.query.run_query', return_value=([], []))
+    def test_translation_cache_large_statements(self, m):
+        clear_translation_cache()
+        cursor = connect().cursor()
+        values = list(range(5000))
+        for i in range(20):
+            cursor.execute('SELECT name FROM customEvents WHERE itemCount IN %(values)s', {'values': values[i:]})
+        cursor.execute('SELECT name FROM customEvents WHERE itemCount IN %(values)s', {'values': values[:2]})
+
+        # only the short statement is kept
+        self.assertEqual(query._cached_translate_query.cache_info().currsize, 1)
+        self.assertIn('4999', m.call_args_list[0][0][6])
+
+    @mock.patch('adx_db.query.run_query', return_value=([], []))
+    def test_request_properties(self, m):
+        conn = connect(path='authority/db', results_cache_max_age='600', query_consistency='weak',
+                       truncation_max_records='1000')
+        conn.execute('customEvents | take 1')
+        conn.execute('customEvents | take 1', request_properties={'no_truncation': True, 'server_timeout': 30})
+
+        properties = m.call_args_list[0][0][7]
+        self.assertEqual(properties.get_option('query_results_cache_max_age', None), '0.00:10:00')
+        self.assertEqual(properties.get_option('queryconsistency', None), 'weakconsistency')
+        self.assertEqual(properties.get_option('truncationmaxrecords', None), 1000)
+        self.assertFalse(properties.has_option('notruncation'))
+
+        properties = m.call_args_list[1][0][7]
+        self.assertEqual(properties.get_option('truncationmaxrecords', None), 1000)
+        self.assertTrue(properties.get_option('notruncation', None))
+        self.assertEqual(properties.get_option('servertimeout', None), '0.00:00:30')
+
+    def test_unknown_request_property(self):
+        with self.assertRaises(exceptions.ProgrammingError):
+            connect(results_cache_age=600)
+
+    @mock.patch('adx_db.query.get_client')
+    def test_execute_many_queries(self, m):
+        m.return_value.execute.return_value.primary_results = [
+            mock.Mock(raw_rows=[['a']], raw_columns=[{'ColumnName': 'name', 'ColumnType': 'string'}]),
+            mock.Mock(raw_rows=[[2]], raw_columns=[{'ColumnName': 'cnt', 'ColumnType': 'long'}]),
+        ]
+
+        conn = connect(path='authority/db', timeout=30)
+        cursor1, cursor2 = conn.execute_many_queries([
+            'customEvents | project name',
+            ('SELECT count(*) AS cnt FROM customEvents WHERE name = %(name)s', {'name': 'a'}),
+        ])
+
+        db, kql, properties = m.return_value.execute.call_args[0]
+        self.assertEqual(m.return_value.execute.call_count, 1)
+        self.assertEqual(kql.split(';\n')[0], 'customEvents | project name')
+        self.assertEqual(properties.get_option('servertimeout', None), '0.00:00:30')
+        self.assertEqual(cursor1.description[0][0], 'name')
+        self.assertEqual(cursor1.fetchall()[0].name, 'a')
+        self.assertEqual(cursor2.description[0][0], 'cnt')
+        self.assertEqual(cursor2.fetchone().cnt, 2)
+
+    @mock.patch('adx_db.query.get_client')
+    def test_execute_many_queries_cancel(self, m):
+        started, cancelled = self.blocking_client(m)
+        conn = connect(path='authority/db')
+        errors = []
+
+        def execute():
+            try:
+                conn.execute_many_queries(['customEvents | take 1', 'customEvents | take 2'])
+            except exceptions.OperationalError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=execute)
+        thread.start()
+        started.wait(5)
+        conn.cursors[0].cancel()
+        thread.join(5)
+
+        self.assertEqual(str(errors[0]), 'Query cancelled')
+        self.assertTrue(cancelled.wait(5))
+
+    def test_batches(self):
+        queries = [
+            'let __in_list_0 = dynamic([1]);\nT | where a in (__in_list_0)',
+            'T | take 1',
+            'let __in_list_0 = dynamic([2]);\nT | where a in (__in_list_0)',
+        ]
+        self.assertEqual(list(batches(queries)), [[0, 1], [2]])
+
+    def blocking_client(self, m):
+        """Make the queries of the mocked client block until they are cancelled."""
+        started, cancelled = threading.Event(), threading.Event()
+
+        def execute(db, query, properties=None):
+            if query.startswith('.cancel query'):
+                cancelled.set()
+                return mock.Mock()
+            started.set()
+            cancelled.wait(5)
+            raise Exception('Query was cancelled')
+
+        m.return_value.execute.side_effect = execute
+        return started, cancelled
+
+    @mock.patch('adx_db.query.get_client')
+    def test_cursor_cancel(self, m):
+        started, cancelled = self.blocking_client(m)
+        cursor = connect(path='authority/db').cursor()
+        errors = []
+
+        def execute():
+            try:
+                cursor.execute('customEvents | take 10')
+            except exceptions.OperationalError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=execute)
+        thread.start()
+        started.wait(5)
+        cursor.cancel()
+        thread.join(5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(str(errors[0]), 'Query cancelled')
+        self.assertTrue(cancelled.wait(5))
+        query_call, cancel_call = m.return_value.execute.call_args_list
+        self.assertEqual(cancel_call[0][1], '.cancel query "{0}"'.format(query_call[0][2].client_request_id))
+
+    @mock.patch('adx_db.query.get_client')
+    def test_cursor_timeout(self, m):
+        started, cancelled = self.blocking_client(m)
+        cursor = connect(path='authority/db', timeout=60).cursor()
+
+        with self.assertRaises(exceptions.OperationalError):
+            cursor.execute('customEvents | take 10', timeout=0.05)
+
+        # the query is shared with the concurrent callers, it is cancelled when none waits for it
+        self.assertTrue(cancelled.wait(5))
+        properties = m.return_value.execute.call_args_list[0][0][2]
+        self.assertFalse(properties.has_option('servertimeout'))
+
+    @mock.patch('adx_db.query.get_client')
+    def test_cursor_cancel_shared_query(self, m):
+        started, release = threading.Event(), threading.Event()
+        response = mock.Mock(tables=[], primary_results=[
+            mock.Mock(raw_rows=[['a']], raw_columns=[{'ColumnName': 'name', 'ColumnType': 'string'}])])
+
+        def execute(db, query, properties=None):
+            if query.startswith('.cancel query'):
+                return mock.Mock()
+            started.set()
+            release.wait(5)
+            return response
+
+        m.return_value.execute.side_effect = execute
+        cursors = [connect(path='authority/db').cursor() for _ in range(2)]
+        errors, results = [], []
+
+        def run(cursor):
+            try:
+                cursor.execute('customEvents | take 10')
+                results.append(cursor)
+            except exceptions.OperationalError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(cursor,)) for cursor in cursors]
+        threads[0].start()
+        started.wait(5)
+        threads[1].start()
+        deadline = time.time() + 5
+        while time.time() < deadline and not any(
+                len(call.waiters) == 2 for call in query.in_flight_queries._calls.values()):
+            time.sleep(0.01)
+
+        cursors[0].cancel()
+        threads[0].join(5)
+        release.set()
+        threads[1].join(5)
+
+        self.assertEqual([str(e) for e in errors], ['Query cancelled'])
+        self.assertEqual(results, [cursors[1]])
+        self.assertEqual([row.name for row in cursors[1].fetchall()], ['a'])
+        self.assertEqual([call[0][1] for call in m.return_value.execute.call_args_list], ['customEvents | take 10'])
+
+    @mock.patch('adx_db.query.get_client')
+    def test_query_error(self, m):
+        m.return_value.execute.side_effect = Exception('Syntax error')
+        cursor = connect(path='authority/db').cursor()
+
+        with self.assertRaises(exceptions.OperationalError):
+            cursor.execute('customEvents | take')
+
+    @mock.patch('adx_db.query.get_client')
+    def test_cursor_query_stats(self, m):
+        consumption = {
+            'ExecutionTime': 0.25,
+            'resource_usage': {
+                'cache': {'memory': {'hits': 3, 'misses': 1}, 'disk': {'hits': 1, 'misses': 0},
+                          'shards': {'hot': {'hitbytes': 1024, 'missbytes': 0}}},
+                'cpu': {'total cpu': '00:00:01.5'},
+                'memory': {'peak_per_node': 2048},
+            },
+            'input_dataset_statistics': {'extents': {'total': 10, 'scanned': 2},
+                                         'rows': {'total': 1000, 'scanned': 200}},
+            'dataset_statistics': [{'table_row_count': 1, 'table_size': 16}],
+        }
+        response = m.return_value.execute.return_value
+        response.primary_results = [
+            mock.Mock(raw_rows=[['a']], raw_columns=[{'ColumnName': 'name', 'ColumnType': 'string'}]),
+        ]
+        response.tables = response.primary_results + [mock.Mock(
+            table_kind=WellKnownDataSet.QueryCompletionInformation,
+            raw_columns=[{'ColumnName': 'EventTypeName'}, {'ColumnName': 'Payload'}],
+            raw_rows=[['QueryInfo', '{}'], ['QueryResourceConsumption', json.dumps(consumption)]],
+        )]
+        events = []
+        hook = lambda event, data: events.append((event, data))  # noqa: E731
+        instrumentation.add_hook(hook)
+        self.addCleanup(instrumentation.remove_hook, hook)
+
+        cursor = connect(path='authority/db').cursor()
+        cursor.execute('customEvents | take 1')
+
+        stats = cursor.query_stats
+        self.assertEqual(stats['cpu_time'], 1.5)
+        self.assertEqual(stats['cache_hits'], 4)
+        self.assertEqual(stats['extents_scanned'], 2)
+        self.assertEqual(stats['rows_scanned'], 200)
+        self.assertEqual(stats['result_rows'], 1)
+        self.assertEqual(stats['result_size'], 16)
+        self.assertEqual(stats['retries'], 0)
+        self.assertFalse(stats['result_cache_hit'])
+        event, data = [e for e in events if e[0] == 'query_stats'][0]
+        self.assertEqual(data['stats']['cpu_time'], 1.5)
+        self.assertEqual(data['database'], 'db')
+
+    @mock.patch('adx_db.query.run_query')
+    def test_cursor_explain(self, m):
+        m.return_value = ([['Plan', 'json', '{}']], [{'ColumnName': 'ResultType'}, {'ColumnName': 'Format'},
+                                                    {'ColumnName': 'Content'}])
+        cursor = connect(path='authority/db').cursor()
+        sql = 'SELECT name FROM (SELECT name FROM customEvents WHERE 1 = 1) AS expr_qry LIMIT %(limit)s'
+
+        explanation = cursor.explain(sql, {'limit': 10})
+        self.assertEqual(explanation['sql'], sql.replace('%(limit)s', '10'))
+        self.assertEqual(explanation['rewrites'], ['simplify', 'push_down_limit'])
+        self.assertIn('| limit 10)', explanation['kql'])
+        self.assertIsNone(explanation['plan'])
+        self.assertFalse(m.called)
+
+        explanation = cursor.explain(sql, {'limit': 10}, plan=True)
+        self.assertEqual(m.call_args[0][6], '.show queryplan <| {0}'.format(explanation['kql']))
+        self.assertEqual(explanation['plan'], [{'ResultType': 'Plan', 'Format': 'json', 'Content': '{}'}])
+        self.assertIsNone(cursor.description)
+
+    @mock.patch('adx_db.query.get_client')
+    def test_query_log(self, m):
+        m.return_value.execute.return_value.primary_results = [
+            mock.Mock(raw_rows=[['a']], raw_columns=[{'ColumnName': 'name', 'ColumnType': 'string'}]),
+        ]
+        cursor = connect(path='authority/db', password='secret').cursor()
+
+        with self.assertLogs('adx_db.queries', 'INFO') as logs:
+            cursor.execute('customEvents | take 1')  # disabled, not logged
+            instrumentation.query_log.sample_rate = 1.0
+            self.addCleanup(setattr, instrumentation.query_log, 'sample_rate', 0.0)
+            cursor.execute('customEvents | take 2')
+
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('customEvents | take 2', logs.output[0])
+        self.assertIn("'rows': 1", logs.output[0])
+        self.assertNotIn('secret', logs.output[0])
+
+    def test_redact(self):
+        self.assertEqual(instrumentation.redact({'user': 'app', 'password': 'secret', 'client_secret': None}),
+                         {'user': 'app', 'password': '***', 'client_secret': None})
+
+    def test_timespan_seconds(self):
+        self.assertEqual(timespan_seconds('00:00:01.5'), 1.5)
+        self.assertEqual(timespan_seconds('1.02:00:00'), 93600)
+
+    def test_format_timespan(self):
+        self.assertEqual(format_timespan(86400), '1.00:00:00')
+        self.assertEqual(format_timespan('93600.5'), '1.02:00:00.5000000')
+        self.assertEqual(format_timespan(timedelta(days=2, microseconds=1)), '2.00:00:00.0000010')
+        self.assertEqual(timespan_seconds(format_timespan(90061.25)), 90061.25)
+        self.assertEqual(build_request_properties({'results_cache_max_age': 86400}).get_option(
+            'query_results_cache_max_age', None), '1.00:00:00')
+
+    @mock.patch('adx_db.query.KustoClient')
+    def test_unauthenticated(self, m):
+        self.assertFalse(connect().unauthenticated)
+        self.assertTrue(connect(unauthenticated='true').unauthenticated)
+
+        host_url = 'https://unauthenticated.kusto.windows.net'
+        self.addCleanup(lambda: [query._clients.pop(key) for key in list(query._clients) if key[0] == host_url])
+        query.get_client(host_url, 'app', 'secret', 'authority')
+        query.get_client(host_url, '', '', 'authority', unauthenticated=True)
+
+        self.assertTrue(m.call_args_list[0][0][0].aad_federated_security)
+        self.assertFalse(m.call_args_list[1][0][0].aad_federated_security)
+
+    def test_cursor_next_page_without_execute_page(self):
+        cursor = connect().cursor()
+        with self.assertRaises(exceptions.ProgrammingError):
+            cursor.next_page()
+
     # def test_connection_execute(self, m):
     #     m.get(
     #         'http://docs.google.com/gviz/tq?gid=0&tq=SELECT%20%2A%20LIMIT%200',
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from .context import RetryPolicy, connect, exceptions
+from .fake_kusto import FakeKusto
+
+
+class EndToEndTestSuite(unittest.TestCase):
+    """The whole path, through http and the kusto client, against the fake cluster of `fake_kusto.py`."""
+
+    def setUp(self):
+        self.kusto = FakeKusto(rows=20, seed=0).start()
+        self.addCleanup(self.kusto.stop)
+
+    def connect(self, **kwargs):
+        return connect(host=self.kusto.host, scheme='http', path='authority/db', unauthenticated=True, **kwargs)
+
+    def test_execute_fetch(self):
+        cursor = self.connect().cursor()
+        cursor.execute('SELECT name, itemCount FROM customEvents LIMIT 5')
+
+        self.assertEqual(self.kusto.queries[-1], 'customEvents | project name, itemCount | limit 5')
+        self.assertEqual([column[0] for column in cursor.description][:2], ['timestamp', 'name'])
+        rows = cursor.fetchall()
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[1].itemCount, 1)
+        self.assertEqual(cursor.query_stats['rows_scanned'], 5)
+
+        first, second = self.connect().execute_many_queries(['customEvents | take 2', 'customEvents'])
+        self.assertEqual((first.rowcount, second.rowcount), (2, 20))
+
+    def test_errors(self):
+        self.kusto.error_rate, self.kusto.error_status = 1.0, 429
+        cursor = self.connect(retry_policy=RetryPolicy(max_attempts=2, base_delay=0.01)).cursor()
+
+        with self.assertRaises(exceptions.OperationalError):
+            cursor.execute('customEvents | take 1')
+        self.assertEqual(self.kusto.requests, 2)
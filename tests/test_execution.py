@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest import mock
+
+from azure.kusto.data.exceptions import KustoServiceError
+
+from .context import connect, exceptions, instrumentation, RetryPolicy
+
+
+COLUMNS = [{'ColumnName': 'name', 'ColumnType': 'string'}]
+
+
+def kusto_error(status, retry_after=None):
+    headers = {'Retry-After': retry_after} if retry_after is not None else {}
+    return KustoServiceError('error {0}'.format(status), mock.Mock(status_code=status, headers=headers))
+
+
+def response():
+    return mock.Mock(primary_results=[mock.Mock(raw_rows=[['a']], raw_columns=COLUMNS)])
+
+
+class RetryTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        instrumentation.metrics.reset()
+
+    def test_delay(self):
+        policy = RetryPolicy(max_attempts=3, base_delay=1, max_delay=3)
+
+        with mock.patch('random.uniform', side_effect=lambda a, b: b):
+            self.assertEqual(policy.delay(0, kusto_error(429)), 1)
+            self.assertEqual(policy.delay(1, kusto_error(503)), 2)
+            self.assertEqual(policy.delay(0, kusto_error(429, retry_after='5')), 5)
+        self.assertIsNone(policy.delay(2, kusto_error(429)))
+        self.assertIsNone(policy.delay(0, kusto_error(400)))
+        self.assertIsNone(policy.delay(0, ValueError()))
+
+    @mock.patch('adx_db.query.get_client')
+    def test_retry_transient_error(self, m):
+        m.return_value.execute.side_effect = [kusto_error(429, retry_after='0'), response()]
+
+        cursor = connect(path='authority/db', retry_policy=RetryPolicy(base_delay=0)).cursor()
+        cursor.execute('customEvents | project name')
+
+        self.assertEqual(cursor.fetchone().name, 'a')
+        self.assertEqual(m.return_value.execute.call_count, 2)
+        self.assertEqual(instrumentation.metrics.snapshot()['query_retries'], 1)
+
+    @mock.patch('adx_db.query.get_client')
+    def test_no_retry(self, m):
+        m.return_value.execute.side_effect = [kusto_error(400), response()]
+        with self.assertRaises(exceptions.OperationalError):
+            connect(path='authority/db').execute('customEvents | project name')
+
+        # control commands may not be idempotent
+        m.return_value.execute.side_effect = [kusto_error(503), response()]
+        with self.assertRaises(exceptions.OperationalError):
+            connect(path='authority/db').execute('.show tables')
+
+        m.return_value.execute.side_effect = [kusto_error(503), response()]
+        with self.assertRaises(exceptions.OperationalError):
+            connect(path='authority/db', retry_policy='1').execute('customEvents | take 1')
+
+        self.assertEqual(m.return_value.execute.call_count, 3)
+        self.assertNotIn('query_retries', instrumentation.metrics.snapshot())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from .context import connect, query, result_cache
+
+
+COLUMNS = [{'ColumnName': 'name', 'ColumnType': 'string'}]
+
+
+class ResultCacheTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        query.result_cache.clear()
+
+    @mock.patch('adx_db.query.run_query', return_value=([['a'], ['b']], COLUMNS))
+    def test_shared_result(self, m):
+        cursor1 = connect(path='authority/db', result_cache_ttl=60).cursor()
+        cursor2 = connect(path='authority/db', result_cache_ttl=60).cursor()
+        cursor1.execute('customEvents | project name')
+        cursor2.execute('customEvents | project name')
+
+        self.assertEqual(m.call_count, 1)
+        self.assertIs(cursor1._results, cursor2._results)
+        self.assertEqual([row.name for row in cursor1.fetchall()], ['a', 'b'])
+        self.assertEqual([row.name for row in cursor2.fetchmany(5)], ['a', 'b'])
+        self.assertEqual(cursor1.fetchall(), [])
+
+    @mock.patch('adx_db.query.run_query', return_value=([['a']], COLUMNS))
+    def test_opt_in(self, m):
+        cursor = connect(path='authority/db').cursor()
+        cursor.execute('customEvents | project name')
+        cursor.execute('customEvents | project name')
+
+        self.assertEqual(m.call_count, 2)
+
+    @mock.patch('adx_db.query.run_query', return_value=([['a']], COLUMNS))
+    def test_relative_time(self, m):
+        cursor = connect(path='authority/db', result_cache_ttl=3600).cursor()
+        query = 'customEvents | where timestamp > ago(1h) | project name'
+        cursor.execute(query)
+
+        with mock.patch('time.time', return_value=result_cache.time.time() + 60):
+            cursor.execute(query)
+            cursor.execute('customEvents | project name')
+            cursor.execute('customEvents | project name')
+
+        self.assertEqual(m.call_count, 3)
+
+    def test_max_bytes(self):
+        cache = result_cache.ResultCache(max_bytes=10)
+        cache.set('a', ('a',), None, 6)
+        cache.set('b', ('b',), None, 6)
+        cache.set('c', ('c',), None, 11)
+
+        self.assertIsNone(cache.get('a', 60))
+        self.assertEqual(cache.get('b', 60), (('b',), None))
+        self.assertIsNone(cache.get('c', 60))
+        self.assertEqual(cache.size, 6)
+
+    @mock.patch('adx_db.query.run_query', return_value=([['a']], COLUMNS))
+    def test_disk_tier(self, m):
+        with tempfile.TemporaryDirectory() as path:
+            cursor = connect(path='authority/db', result_cache_ttl=60, result_cache_path=path).cursor()
+            cursor.execute('customEvents | project name')
+            query.result_cache.clear()
+            cursor.execute('customEvents | project name')
+
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(cursor.fetchone().name, 'a')
+
+
+    def test_estimate_size(self):
+        rows = [['event-{0}'.format(i % 10)] for i in range(10000)]
+        size = len(result_cache.dump_payload(rows, COLUMNS))
+
+        self.assertEqual(result_cache.estimate_size(rows[:10], COLUMNS),
+                         len(result_cache.dump_payload(rows[:10], COLUMNS)))
+        self.assertAlmostEqual(result_cache.estimate_size(rows, COLUMNS) / size, 1, delta=0.05)
+
+    def test_disk_eviction(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = result_cache.DiskResultCache(path, max_bytes=400)
+            with mock.patch('os.listdir', wraps=os.listdir) as listdir:
+                for i in range(3):
+                    cache.set(('a', i), 'x' * 20)
+                self.assertEqual(listdir.call_count, 1)
+
+                for i in range(10):
+                    cache.set(('b', i), 'x' * 20)
+                self.assertLess(listdir.call_count, 10)
+
+            self.assertTrue(os.listdir(path))
+            self.assertLessEqual(sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)), 400)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from adx_db.parse import parse
+from adx_db.simplify import simplify, simplify_expression
+
+from .context import translate
+
+
+class SimplifyTestSuite(unittest.TestCase):
+
+    def test_drop_tautology(self):
+        result = simplify_expression({'and': [{'eq': [1, 1]}, {'eq': ['x', {'literal': 'a'}]}]})
+        expected = {'eq': ['x', {'literal': 'a'}]}
+        self.assertEqual(result, expected)
+
+    def test_double_not(self):
+        result = simplify_expression({'not': {'not': {'eq': ['a', 2]}}})
+        expected = {'eq': ['a', 2]}
+        self.assertEqual(result, expected)
+
+    def test_dedupe_and_flatten(self):
+        result = simplify_expression({'or': [{'eq': ['a', 1]}, {'eq': ['a', 1]}, {'or': [{'eq': ['a', 2]}, 'false']}]})
+        expected = {'or': [{'eq': ['a', 1]}, {'eq': ['a', 2]}]}
+        self.assertEqual(result, expected)
+
+    def test_fold_arithmetic(self):
+        result = simplify_expression({'gt': [{'add': ['x', {'mul': [2, 3]}, 1]}, {'sub': [10, 4]}]})
+        expected = {'gt': [{'add': ['x', 7]}, 6]}
+        self.assertEqual(result, expected)
+
+    def test_integer_division(self):
+        self.assertEqual(simplify_expression({'div': [7, 2]}), 3)
+        self.assertEqual(simplify_expression({'div': [-7, 2]}), {'div': [-7, 2]})
+        self.assertEqual(simplify_expression({'div': [7, 0]}), {'div': [7, 0]})
+
+    def test_contradiction(self):
+        result = simplify_expression({'or': [{'eq': [{'literal': 'a'}, {'literal': 'b'}]}, {'gt': [1, 2]}]})
+        self.assertIs(result, False)
+
+    def test_where_dropped(self):
+        result = simplify(parse("SELECT * FROM customEvents WHERE 1 = 1 AND 'a' = 'a'"))
+        expected = {'select': '*', 'from': 'customEvents'}
+        self.assertEqual(result, expected)
+
+    def test_translate(self):
+        sql = """
+        SELECT name, 60 * 60 * 24 AS seconds
+        FROM customEvents
+        WHERE 1 = 1 AND NOT NOT name = 'click' AND (name = 'click' OR 1 = 0)
+        """
+        expected = "customEvents | where name == 'click' | project name, seconds=86400"
+        result = translate(parse(sql))
+        self.assertEqual(result, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+from unittest import mock
+
+from .context import instrumentation, query
+
+
+COLUMNS = [{'ColumnName': 'name', 'ColumnType': 'string'}]
+
+
+class SingleFlightTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        instrumentation.metrics.reset()
+
+    def run_concurrently(self, kql, callers=5):
+        started, release = threading.Event(), threading.Event()
+
+        def run_query(*args):
+            started.set()
+            release.wait()
+            return [['a']], COLUMNS
+
+        results = []
+        with mock.patch('adx_db.query.run_query', side_effect=run_query) as m:
+            threads = [
+                threading.Thread(target=lambda: results.append(query.execute(kql, path='authority/db')))
+                for _ in range(callers)
+            ]
+            threads[0].start()
+            started.wait()
+            for thread in threads[1:]:
+                thread.start()
+
+            # wait for the other callers to queue behind the first one
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                calls = list(query.in_flight_queries._calls.values())
+                if not calls or len(calls[0].waiters) == callers:
+                    break
+                time.sleep(0.01)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        return m, results
+
+    def test_coalesce_identical_queries(self):
+        m, results = self.run_concurrently('customEvents | project name')
+
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(rows is results[0][0] for rows, _ in results))
+        self.assertEqual(instrumentation.metrics.snapshot()['queries_coalesced'], 4)
+
+    def test_control_commands_are_not_coalesced(self):
+        m, results = self.run_concurrently('.show tables', callers=2)
+
+        self.assertEqual(m.call_count, 2)
+        self.assertNotIn('queries_coalesced', instrumentation.metrics.snapshot())
+
+    def test_error_is_shared(self):
+        flight = query.SingleFlight()
+        with self.assertRaises(ValueError):
+            flight.do('key', mock.Mock(side_effect=ValueError))
+        self.assertEqual(flight.do('key', lambda cancellation: 1), (1, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,7 @@ import unittest
 
 from adx_db.parse import parse
 
-from .context import translate
+from .context import translate, paginate, exceptions
 
 
 class TranslationTestSuite(unittest.TestCase):
@@ -311,6 +311,183 @@ class TranslationTestSuite(unittest.TestCase):
         result = translate(parse(sql))
         self.assertEqual(result, expected)
 
+    def test_limit_push_down_nested_query(self):
+        sql = """
+        SELECT name AS name
+        FROM (SELECT name, user_Id FROM customEvents WHERE user_Id > 1) AS expr_qry
+        LIMIT 1000;
+        """
+        expected = '(customEvents | where user_Id > 1 | project name, user_Id | limit 1000) | project name=name | limit 1000'
+        result = translate(parse(sql))
+        self.assertEqual(result, expected)
+
+    def test_limit_push_down_keeps_smaller_inner_limit(self):
+        sql = 'SELECT name FROM (SELECT name FROM customEvents LIMIT 10) AS expr_qry LIMIT 1000'
+        expected = '(customEvents | project name | limit 10) | project name | limit 1000'
+        result = translate(parse(sql))
+        self.assertEqual(result, expected)
+
+    def test_limit_push_down_union(self):
+        sql = """
+        SELECT *
+        FROM (SELECT name FROM customEvents UNION ALL SELECT name FROM pageViews) AS expr_qry
+        LIMIT 100
+        """
+        expected = '((customEvents | project name | limit 100) | union (pageViews | project name | limit 100)) | limit 100'
+        result = translate(parse(sql))
+        self.assertEqual(result, expected)
+
+    def test_limit_not_pushed_below_aggregation(self):
+        sql = """
+        SELECT name, count(*) AS cnt
+        FROM (SELECT name FROM customEvents) AS expr_qry
+        GROUP BY name
+        LIMIT 100
+        """
+        expected = '(customEvents | project name) | summarize cnt=count() by name | limit 100'
+        result = translate(parse(sql))
+        self.assertEqual(result, expected)
+
+    def test_limit_not_pushed_below_where(self):
+        sql = 'SELECT name FROM (SELECT name FROM customEvents) AS expr_qry WHERE name = \'a\' LIMIT 100'
+        expected = "(customEvents | project name) | where name == 'a' | project name | limit 100"
+        result = translate(parse(sql))
+        self.assertEqual(result, expected)
+
+    def test_having_alias(self):
+        sql = """
+        SELECT name, COUNT(*) AS cnt
+        FROM customEvents
+        GROUP BY name
+        HAVING COUNT(*) > 10
+        ORDER BY cnt DESC
+        """
+        expected = 'customEvents | summarize cnt=count() by name | where cnt > 10 | order by cnt desc'
+        result = translate(parse(sql))
+        self.assertEqual(result, expected)
+
+    def test_having_aggregate_not_selected(self):
+        sql = """
+        SELECT name, COUNT(*) AS cnt
+        FROM customEvents
+        GROUP BY name
+        HAVING dcount(user_Id) > 10
+        """
+        expected = 'customEvents | summarize cnt=count(), __having_0=dcount(user_Id) by name | where __having_0 > 10 | project-away __having_0'
+        result = translate(parse(sql))
+        self.assertEqual(result, expected)
+
+    def test_having_aggregate_selected_without_alias(self):
+        sql = 'SELECT name, COUNT(*), sum(itemCount) FROM customEvents GROUP BY name HAVING COUNT(*) > 10 AND sum(itemCount) > 1'
+        expected = 'customEvents | summarize count(), sum(itemCount) by name | where count_ > 10 and sum_itemCount > 1'
+        result = translate(parse(sql))
+        self.assertEqual(result, expected)
+
+    def test_having_without_groupby(self):
+        sql = 'SELECT COUNT(*) AS cnt FROM customEvents HAVING COUNT(*) > 10'
+        expected = 'customEvents | summarize cnt=count() | where cnt > 10'
+        result = translate(parse(sql))
+        self.assertEqual(result, expected)
+
+    def test_offset(self):
+        sql = 'SELECT name FROM customEvents ORDER BY timestamp LIMIT 100 OFFSET 200'
+        expected = 'customEvents | project name | order by timestamp | serialize __row_number=row_number() | where __row_number > 200 and __row_number <= 300 | project-away __row_number'
+        result = translate(parse(sql))
+        self.assertEqual(result, expected)
+
+    def test_offset_without_limit(self):
+        sql = 'SELECT name FROM customEvents OFFSET 200'
+        expected = 'customEvents | project name | serialize __row_number=row_number() | where __row_number > 200 | project-away __row_number'
+        result = translate(parse(sql))
+        self.assertEqual(result, expected)
+
+    def test_paginate(self):
+        sql = 'SELECT name, timestamp FROM customEvents ORDER BY timestamp DESC'
+        expected = 'customEvents | project name, timestamp | order by timestamp desc | serialize __row_number=row_number() | where __row_number > 20 and __row_number <= 30 | project-away __row_number'
+        result = translate(paginate(parse(sql), 20, 10))
+        self.assertEqual(result, expected)
+
+    def test_paginate_default_order(self):
+        sql = 'SELECT name AS event_name, count(*) AS cnt FROM customEvents GROUP BY name'
+        expected = 'customEvents | summarize cnt=count() by event_name=name | order by event_name | serialize __row_number=row_number() | where __row_number > 0 and __row_number <= 10 | project-away __row_number'
+        result = translate(paginate(parse(sql), 0, 10))
+        self.assertEqual(result, expected)
+
+    def test_paginate_within_limit(self):
+        sql = 'SELECT name FROM customEvents ORDER BY name LIMIT 25'
+        expected = 'customEvents | project name | order by name | serialize __row_number=row_number() | where __row_number > 20 and __row_number <= 25 | project-away __row_number'
+        result = translate(paginate(parse(sql), 20, 10))
+        self.assertEqual(result, expected)
+
+    def test_paginate_needs_order(self):
+        with self.assertRaises(exceptions.NotSupportedError):
+            paginate(parse('SELECT * FROM customEvents'), 0, 10)
+
+    def test_with(self):
+        sql = """
+        WITH signups AS (SELECT user_Id FROM customEvents WHERE name = 'signup')
+        SELECT * FROM signups
+        """
+        expected = "let signups = customEvents | where name == 'signup' | project user_Id; signups"
+        result = translate(parse(sql))
+        self.assertEqual(result, expected)
+
+    def test_with_materialize(self):
+        sql = """
+        WITH signups AS (SELECT user_Id FROM customEvents WHERE name = 'signup')
+        SELECT * FROM signups
+        UNION ALL
+        SELECT * FROM signups
+        """
+        expected = "let signups = materialize(customEvents | where name == 'signup' | project user_Id); (signups) | union (signups)"
+        result = translate(parse(sql))
+        self.assertEqual(result, expected)
+
+    def test_with_referenced_by_ctes(self):
+        sql = """
+        WITH cohort AS (SELECT user_Id FROM customEvents),
+             a AS (SELECT user_Id FROM cohort),
+             b AS (SELECT user_Id FROM cohort)
+        SELECT * FROM a
+        """
+        expected = 'let cohort = materialize(customEvents | project user_Id); let a = cohort | project user_Id; let b = cohort | project user_Id; a'
+        result = translate(parse(sql))
+        self.assertEqual(result, expected)
+
+    def test_with_column_named_as_cte(self):
+        sql = """
+        WITH name AS (SELECT name FROM customEvents WHERE itemCount > 1)
+        SELECT name FROM name
+        """
+        expected = 'let name = customEvents | where itemCount > 1 | project name; name | project name'
+        result = translate(parse(sql))
+        self.assertEqual(result, expected)
+
+    def test_in_large_list(self):
+        values = ', '.join("'user-{0}'".format(i) for i in range(5000))
+        sql = 'SELECT name FROM customEvents WHERE user_Id IN ({0}) AND name = \'click\''.format(values)
+
+        parsed = parse(sql)
+        self.assertEqual(parsed['where']['and'][0]['in'][1]['literal'][4999], 'user-4999')
+
+        result = translate(parsed)
+        self.assertTrue(result.startswith('let __in_list_0 = dynamic(["user-0", "user-1", '))
+        self.assertTrue(result.endswith(
+            '"user-4999"]); customEvents | where user_Id in (__in_list_0) and name == \'click\' | project name'))
+
+    def test_in_large_list_unicode(self):
+        values = ', '.join("'café-{0}'".format(i) for i in range(5000))
+        result = translate(parse('SELECT name FROM customEvents WHERE user_Id IN ({0})'.format(values)))
+
+        # the values are not escaped to \\u sequences
+        self.assertTrue(result.startswith('let __in_list_0 = dynamic(["café-0", "café-1", '))
+
+    def test_in_list_inside_string(self):
+        sql = "SELECT * FROM customEvents WHERE name = 'a in (1, 2)' AND user_Id IN (1, 2)"
+        expected = "customEvents | where name == 'a in (1, 2)' and user_Id in (1, 2)"
+        result = translate(parse(sql))
+        self.assertEqual(result, expected)
+
 
 if __name__ == '__main__':
     unittest.main()